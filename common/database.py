@@ -0,0 +1,73 @@
+"""
+Environment-driven database configuration, shared by the search and user
+services.
+
+DB_ENGINE selects 'sqlite' (default) or 'postgres'. SQLite connections are
+switched to WAL with synchronous=NORMAL, a busy timeout and memory-mapped
+I/O by `configure_sqlite`, which the app connects to `connection_created`.
+PostgreSQL uses persistent connections (DB_CONN_MAX_AGE) or, with
+DB_POOL=true, psycopg's connection pool on Django 5.1 and later.
+"""
+
+import os
+
+import django
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def database_from_env(base_dir, name):
+    """The 'default' database; `name` is the PostgreSQL database unless DB_NAME is set."""
+    engine = os.getenv("DB_ENGINE", "sqlite")
+    if engine == 'sqlite':
+        config = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv("DB_NAME", base_dir / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds to wait for a competing writer before "database is locked".
+                'timeout': float(os.getenv("SQLITE_BUSY_TIMEOUT", 20)),
+            },
+        }
+        if django.VERSION >= (5, 1):
+            # Take the write lock when a transaction starts, so concurrent
+            # writers queue on the busy timeout instead of failing to
+            # upgrade a read lock mid-transaction.
+            config['OPTIONS']['transaction_mode'] = os.getenv("SQLITE_TRANSACTION_MODE", "IMMEDIATE")
+        return config
+    if engine == 'postgres':
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("DB_NAME", name),
+            'USER': os.getenv("DB_USER", ""),
+            'PASSWORD': os.getenv("DB_PASSWORD", ""),
+            'HOST': os.getenv("DB_HOST", "localhost"),
+            'PORT': os.getenv("DB_PORT", "5432"),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+        if _env_bool("DB_POOL", False) and django.VERSION >= (5, 1):
+            # Pooled connections replace persistent ones (CONN_MAX_AGE must be 0).
+            # Older Django has no 'pool' option and keeps persistent ones.
+            config['CONN_MAX_AGE'] = 0
+            config['OPTIONS']['pool'] = {
+                'min_size': int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+                'max_size': int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                'timeout': float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            }
+        else:
+            config['CONN_MAX_AGE'] = int(os.getenv("DB_CONN_MAX_AGE", 60))
+        return config
+    raise ValueError(f"Unknown DB_ENGINE {engine!r}; expected 'sqlite' or 'postgres'.")
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver applying the SQLite PRAGMAs."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(float(os.getenv('SQLITE_BUSY_TIMEOUT', 20)) * 1000)}")
+        cursor.execute(f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}")
@@ -1,35 +1,199 @@
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
+from .cache import get_cache, location_cell
+from .metrics import span
+from .http_client import get_async_http_client, get_http_client
+from .query import canonical_query
+from .ratelimit import get_limiter
+
 class GooglePlacesAdapter:
-    def __init__(self):
+    """
+    Places Text Search behind the places cache. `on_fetch(results, query)`,
+    if given, is called with results fetched from Google, but not with
+    those answered from the cache.
+    """
+
+    def __init__(self, on_fetch=None):
         self.api_key = settings.GOOGLE_MAPS_API_KEY
-        self.base_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+        self.base_url = settings.GOOGLE_PLACES_URL
+        self.on_fetch = on_fetch
 
-    def search_places(self, query, location, radius=5000):
-        params = {
+    def cache_key(self, query, location, radius):
+        # Nearby identical queries share results: key on the query and the
+        # geohash cell of the location rather than the raw coordinate.
+        precision = settings.SEARCH_CACHES['places']['GEOHASH_PRECISION']
+        return f"{canonical_query(query)}|{location_cell(location, precision)}|{radius}"
+
+    def params(self, query, location, radius):
+        return {
             'query': query,
             'location': location,
             'radius': radius,
             'key': self.api_key
         }
-        response = requests.get(self.base_url, params=params)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        return response.json().get('results', [])
+
+    def search_places(self, query, location, radius=5000):
+        cache = get_cache('places')
+        cache_key = self.cache_key(query, location, radius)
+        results = cache.get(cache_key)
+        if results is not None:
+            return results
+
+        get_limiter('places', self.api_key).check()
+        with span('places'):
+            response = get_http_client().get(self.base_url, params=self.params(query, location, radius))
+            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+        results = response.json().get('results', [])
+        cache.set(cache_key, results)
+        if self.on_fetch is not None:
+            self.on_fetch(results, query)
+        return results
 
 class GoogleDistanceMatrixAdapter:
+    # Per-request limits of the Distance Matrix API.
+    MAX_ORIGINS = 25
+    MAX_DESTINATIONS = 25
+    MAX_ELEMENTS = 100
+
     def __init__(self):
         self.api_key = settings.GOOGLE_MAPS_API_KEY
-        self.base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+        self.base_url = settings.GOOGLE_DISTANCE_MATRIX_URL
 
-    def get_distances(self, origins, destinations, mode='walking', units='metric'):
-        params = {
+    def cache_keys(self, origins, destinations, mode, units):
+        # Cache individual origin/destination elements, with the origin
+        # snapped to a geohash cell so users a few metres apart share them.
+        precision = settings.SEARCH_CACHES['distance']['GEOHASH_PRECISION']
+        origin_cell = location_cell(origins, precision)
+        return [f"{origin_cell}|{destination}|{mode}|{units}" for destination in destinations]
+
+    def params(self, origins, destinations, mode, units):
+        return {
             'origins': origins,
             'destinations': "|".join(destinations),
             'mode': mode,
             'units': units,
             'key': self.api_key
         }
-        response = requests.get(self.base_url, params=params)
-        response.raise_for_status()
-        return response.json()
+
+    def merge(self, cache, keys, elements, missing, data):
+        """
+        Fill the `missing` slots of `elements` from an upstream response for
+        just those destinations, caching the new elements, and return a
+        Distance Matrix response covering every destination in order.
+        """
+        if data.get('status') != 'OK':
+            return data
+        fetched = data.get('rows', [{}])[0].get('elements', [])
+        for idx, elem in zip(missing, fetched):
+            elements[idx] = elem
+            if elem.get('status') == 'OK':
+                cache.set(keys[idx], elem)
+        return {
+            'status': 'OK',
+            'rows': [{'elements': [elem or {'status': 'NOT_FOUND'} for elem in elements]}],
+        }
+
+    def get_distances(self, origins, destinations, mode='walking', units='metric'):
+        if "|" in origins:
+            return self._request(origins, destinations, mode, units)
+
+        cache = get_cache('distance')
+        keys = self.cache_keys(origins, destinations, mode, units)
+        elements = [cache.get(key) for key in keys]
+        missing = [idx for idx, elem in enumerate(elements) if elem is None]
+        data = {'status': 'OK'}
+        if missing:
+            data = self._request(origins, [destinations[idx] for idx in missing], mode, units)
+        return self.merge(cache, keys, elements, missing, data)
+
+    def get_distance_matrix(self, origins, destinations, mode='walking', units='metric'):
+        """
+        Elements for every origin x destination pair, as one row per origin.
+        Pairs are served from the cache where possible. Destinations go out in
+        chunks, and with each chunk only the origins missing one of its pairs,
+        as multi-origin requests within the API's origin, destination and
+        element limits. Unfilled pairs are None.
+        """
+        cache = get_cache('distance')
+        rows = []
+        for origin in origins:
+            keys = self.cache_keys(origin, destinations, mode, units)
+            rows.append([cache.get(key) for key in keys])
+
+        for dest_start in range(0, len(destinations), self.MAX_DESTINATIONS):
+            dest_chunk = destinations[dest_start:dest_start + self.MAX_DESTINATIONS]
+            dest_end = dest_start + len(dest_chunk)
+            missing = [pos for pos, row in enumerate(rows) if any(elem is None for elem in row[dest_start:dest_end])]
+            per_request = max(1, min(self.MAX_ORIGINS, self.MAX_ELEMENTS // len(dest_chunk)))
+            for start in range(0, len(missing), per_request):
+                chunk = missing[start:start + per_request]
+                data = self._request("|".join(origins[pos] for pos in chunk), dest_chunk, mode, units)
+                if data.get('status') != 'OK':
+                    continue
+                for pos, row in zip(chunk, data.get('rows', [])):
+                    keys = self.cache_keys(origins[pos], dest_chunk, mode, units)
+                    for offset, (key, elem) in enumerate(zip(keys, row.get('elements', []))):
+                        rows[pos][dest_start + offset] = elem
+                        if elem.get('status') == 'OK':
+                            cache.set(key, elem)
+        return rows
+
+    def _request(self, origins, destinations, mode, units):
+        # Distance Matrix usage is billed and limited per element.
+        get_limiter('distance_matrix', self.api_key).check(len(origins.split("|")) * len(destinations))
+        with span('distance_matrix'):
+            response = get_http_client().get(self.base_url, params=self.params(origins, destinations, mode, units))
+            response.raise_for_status()
+            return response.json()
+
+
+class AsyncGooglePlacesAdapter(GooglePlacesAdapter):
+    """GooglePlacesAdapter for async views, sharing its cache."""
+
+    async def search_places(self, query, location, radius=5000):
+        # The cache and the limiter may call out to a shared backend, so they
+        # run off the event loop.
+        cache = get_cache('places')
+        cache_key = self.cache_key(query, location, radius)
+        results = await sync_to_async(cache.get)(cache_key)
+        if results is not None:
+            return results
+
+        # Never sleep for a token on the event loop.
+        await sync_to_async(get_limiter('places', self.api_key).check)(wait=0)
+        with span('places'):
+            response = await get_async_http_client().get(self.base_url, params=self.params(query, location, radius))
+            response.raise_for_status()
+        results = response.json().get('results', [])
+        await sync_to_async(cache.set)(cache_key, results)
+        if self.on_fetch is not None:
+            await sync_to_async(self.on_fetch)(results, query)
+        return results
+
+
+class AsyncGoogleDistanceMatrixAdapter(GoogleDistanceMatrixAdapter):
+    """GoogleDistanceMatrixAdapter for async views, sharing its cache."""
+
+    async def get_distances(self, origins, destinations, mode='walking', units='metric'):
+        if "|" in origins:
+            return await self._request(origins, destinations, mode, units)
+
+        cache = get_cache('distance')
+        keys = self.cache_keys(origins, destinations, mode, units)
+        elements = await sync_to_async(lambda: [cache.get(key) for key in keys])()
+        missing = [idx for idx, elem in enumerate(elements) if elem is None]
+        data = {'status': 'OK'}
+        if missing:
+            data = await self._request(origins, [destinations[idx] for idx in missing], mode, units)
+        return await sync_to_async(self.merge)(cache, keys, elements, missing, data)
+
+    async def _request(self, origins, destinations, mode, units):
+        limiter = get_limiter('distance_matrix', self.api_key)
+        await sync_to_async(limiter.check)(len(origins.split("|")) * len(destinations), wait=0)
+        with span('distance_matrix'):
+            response = await get_async_http_client().get(
+                self.base_url, params=self.params(origins, destinations, mode, units)
+            )
+            response.raise_for_status()
+            return response.json()
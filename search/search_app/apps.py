@@ -1,6 +1,32 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+
+from common.database import configure_sqlite
+
+logger = logging.getLogger(__name__)
 
 
 class PlacesApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'search_app'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite, dispatch_uid='search_configure_sqlite')
+
+        from .pipeline import reset_pipeline
+        setting_changed.connect(reset_pipeline, dispatch_uid='search_reset_pipeline')
+
+        from .llm import get_registry, reset_registry
+        setting_changed.connect(reset_registry, dispatch_uid='search_reset_registry')
+        # Model clients are built (and with LLM_WARM_CONNECTIONS, connected)
+        # now rather than by this worker's first search. A bad configuration
+        # is reported by searches' enrichment errors too, so it shouldn't
+        # stop the worker from starting.
+        try:
+            get_registry().warm(connect=settings.LLM_WARM_CONNECTIONS)
+        except Exception:
+            logger.exception("Could not build the model clients")
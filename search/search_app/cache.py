@@ -0,0 +1,222 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches as django_caches
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lng, precision=6):
+    """Standard base32 geohash of (lat, lng); precision 6 is a ~1.2km x 0.6km cell."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash):
+    """Return (min_lat, max_lat, min_lng, max_lng) of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if bits >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+def geohash_center(geohash):
+    min_lat, max_lat, min_lng, max_lng = geohash_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+
+
+def geohash_neighbors(geohash):
+    """The cell itself plus the (up to) eight cells around it."""
+    min_lat, max_lat, min_lng, max_lng = geohash_bounds(geohash)
+    lat, lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    dlat, dlng = max_lat - min_lat, max_lng - min_lng
+    cells = []
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            n_lat = lat + i * dlat
+            if not -90 <= n_lat <= 90:
+                continue
+            n_lng = (lng + j * dlng + 180) % 360 - 180
+            cell = geohash_encode(n_lat, n_lng, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def parse_location(location):
+    """Split a "lat,lng" string as passed to the Google adapters."""
+    lat, lng = location.split(",")
+    return float(lat), float(lng)
+
+
+def location_cell(location, precision):
+    return geohash_encode(*parse_location(location), precision=precision)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+class MemoryCache:
+    """In-process LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        self.stats.record(entry is not None)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def hashed_key(prefix, key):
+    """
+    A Django cache key for `key`, which may hold user text: hashed, so it is
+    short and free of the characters memcached rejects.
+    """
+    return prefix + hashlib.sha1(key.encode()).hexdigest()
+
+
+class DjangoCache:
+    """
+    Stores entries in one of Django's configured caches so they are shared
+    between worker processes. Eviction beyond the TTL is left to that backend.
+    """
+
+    def __init__(self, ttl, alias='default', prefix=''):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.backend = django_caches[alias]
+        self.stats = CacheStats()
+
+    def get(self, key):
+        value = self.backend.get(hashed_key(self.prefix, key))
+        self.stats.record(value is not None)
+        return value
+
+    def set(self, key, value):
+        self.backend.set(hashed_key(self.prefix, key), value, self.ttl)
+
+    def clear(self):
+        # The alias also holds rate-limit budgets, throttle counters and
+        # single-flight locks, and its keys can't be listed portably.
+        raise NotImplementedError("A cache in a shared Django alias can't be cleared on its own.")
+
+
+class NullCache:
+    """Used when a cache is disabled; every lookup is a miss."""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.record(False)
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name):
+    """Return the process-wide cache configured under SEARCH_CACHES[name]."""
+    with _caches_lock:
+        if name not in _caches:
+            config = settings.SEARCH_CACHES.get(name, {})
+            backend = config.get('BACKEND', 'memory')
+            if backend == 'memory':
+                cache = MemoryCache(config.get('TTL', 300), config.get('MAX_ENTRIES', 1000))
+            elif backend == 'django':
+                cache = DjangoCache(config.get('TTL', 300), config.get('ALIAS', 'default'), f"{name}:")
+            elif backend == 'none':
+                cache = NullCache()
+            else:
+                raise ValueError(f"Unknown cache backend {backend!r} for {name!r}.")
+            _caches[name] = cache
+        return _caches[name]
+
+
+def cache_stats():
+    with _caches_lock:
+        return {name: cache.stats.as_dict() for name, cache in _caches.items()}
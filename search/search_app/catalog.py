@@ -0,0 +1,153 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import ExpressionWrapper, F, FloatField, Q
+from django.utils import timezone
+
+from .cache import geohash_encode, geohash_neighbors
+from .distance import haversine_m
+from .models import CatalogPlace
+from .query import canonical_query, fold
+
+GEOHASH_PRECISION = 9  # stored per place; lookups use a shorter prefix
+METERS_PER_DEGREE = 111_320
+
+
+def _lookup_precision(lat, radius_m):
+    """
+    Longest geohash prefix whose cells are at least `radius_m` across, so a
+    cell plus its neighbours covers the whole search circle.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lng_bits = math.ceil(5 * precision / 2)
+        lat_bits = 5 * precision // 2
+        height = 180 / 2 ** lat_bits * METERS_PER_DEGREE
+        width = 360 / 2 ** lng_bits * METERS_PER_DEGREE * math.cos(math.radians(lat))
+        if min(height, width) >= radius_m:
+            return precision
+    return 1
+
+
+def _keywords(*texts):
+    words = []
+    for text in texts:
+        for word in fold(text.replace("_", " ")).split():
+            if word not in words:
+                words.append(word)
+    return " ".join(words)
+
+
+def record_places(results, query):
+    """Upsert Places API results into the catalog, remembering the query that found them."""
+    located = {}
+    for place in results:
+        loc = place.get('geometry', {}).get('location', {})
+        if place.get('place_id') and loc.get('lat') is not None and loc.get('lng') is not None:
+            located[place['place_id']] = (place, loc)
+    if not located:
+        return
+
+    existing = dict(
+        CatalogPlace.objects.filter(place_id__in=located).values_list('place_id', 'keywords')
+    )
+    CatalogPlace.objects.bulk_create(
+        [
+            CatalogPlace(
+                place_id=place_id,
+                name=(place.get('name') or '')[:255],
+                address=(place.get('formatted_address') or place.get('vicinity', ''))[:255],
+                latitude=loc['lat'],
+                longitude=loc['lng'],
+                geohash=geohash_encode(loc['lat'], loc['lng'], GEOHASH_PRECISION),
+                rating=place.get('rating'),
+                user_ratings_total=place.get('user_ratings_total'),
+                keywords=_keywords(existing.get(place_id, ''), " ".join(place.get('types', [])), canonical_query(query)),
+                updated_at=timezone.now(),
+            )
+            for place_id, (place, loc) in located.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['place_id'],
+        update_fields=[
+            'name', 'address', 'latitude', 'longitude', 'geohash',
+            'rating', 'user_ratings_total', 'keywords', 'updated_at',
+        ],
+    )
+
+
+# Keeps the catalog places whose FTS5 entry matches every term, in the same query.
+FTS_MATCH_SQL = (
+    "search_app_catalogplace.id IN (SELECT rowid FROM search_app_catalogplace_fts "
+    "WHERE search_app_catalogplace_fts MATCH %s)"
+)
+
+
+def _fts_match(candidates, terms):
+    """`candidates` narrowed to those matching every term via the SQLite FTS5 index, or None if unavailable."""
+    if connection.vendor != 'sqlite':
+        return None
+    match = " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    return candidates.extra(where=[FTS_MATCH_SQL], params=[match])
+
+
+def _keyword_match(candidates, terms):
+    for term in terms:
+        candidates = candidates.filter(Q(name__icontains=term) | Q(keywords__icontains=term))
+    return candidates
+
+
+def search_catalog(query, lat, lng, radius):
+    """
+    Answer a text search from the local catalog. Returns results shaped like
+    the Places API's, nearest-prominent first, within `radius` metres.
+    """
+    terms = canonical_query(query).split()
+    if not terms:
+        return []
+
+    precision = _lookup_precision(lat, radius)
+    cells = geohash_neighbors(geohash_encode(lat, lng, precision))
+    spatial = Q()
+    for cell in cells:
+        # A range rather than startswith, which SQLite won't serve from the index:
+        # '{' sorts right after 'z', the last geohash character.
+        spatial |= Q(geohash__gte=cell, geohash__lt=cell + '{')
+    max_age = timezone.now() - timedelta(days=settings.LOCAL_CATALOG['MAX_AGE_DAYS'])
+    # Nearest first by a flat approximation, so MAX_CANDIDATES keeps the
+    # places closest to the user rather than an arbitrary subset.
+    lng_scale = math.cos(math.radians(lat)) ** 2
+    in_cells = CatalogPlace.objects.filter(spatial, updated_at__gte=max_age).annotate(
+        offset=ExpressionWrapper(
+            (F('latitude') - lat) * (F('latitude') - lat) + (F('longitude') - lng) * (F('longitude') - lng) * lng_scale,
+            output_field=FloatField(),
+        )
+    ).order_by('offset')
+    limit = settings.LOCAL_CATALOG['MAX_CANDIDATES']
+
+    candidates = None
+    matched = _fts_match(in_cells, terms)
+    if matched is not None:
+        try:
+            candidates = list(matched[:limit])
+        except DatabaseError:
+            pass  # no FTS5 table
+    if candidates is None:
+        candidates = list(_keyword_match(in_cells, terms)[:limit])
+    if not candidates:
+        return []
+    distances = haversine_m(lat, lng, [c.latitude for c in candidates], [c.longitude for c in candidates])
+    nearby = [c for c, d in zip(candidates, distances) if d <= radius]
+    nearby.sort(key=lambda c: (c.user_ratings_total or 0, c.rating or 0), reverse=True)
+    return [
+        {
+            'place_id': c.place_id,
+            'name': c.name,
+            'formatted_address': c.address,
+            'geometry': {'location': {'lat': c.latitude, 'lng': c.longitude}},
+            'rating': c.rating,
+            'user_ratings_total': c.user_ratings_total,
+        }
+        for c in nearby
+    ]
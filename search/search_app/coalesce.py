@@ -0,0 +1,104 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches as django_caches
+
+from .cache import hashed_key
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs a function at most once at a time per key. Callers arriving while
+    it runs wait for the in-flight call and receive its result (or error).
+
+    With SINGLE_FLIGHT['SHARED'] enabled the leader in each process also
+    takes a lock in the shared Django cache, and the leaders of other
+    processes wait for the result it publishes there instead of running the
+    function again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0
+        self.coalesced = 0
+        self.coalesced_remote = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, fn):
+        config = settings.SINGLE_FLIGHT
+        if not config['SHARED']:
+            return fn()
+
+        cache = django_caches[config['ALIAS']]
+        lock_key = hashed_key(f"singleflight:{self.name}:lock:", key)
+        result_key = hashed_key(f"singleflight:{self.name}:result:", key)
+
+        if cache.add(lock_key, 1, config['LOCK_TIMEOUT']):
+            try:
+                result = fn()
+                cache.set(result_key, result, config['RESULT_TTL'])
+                return result
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is computing it; wait for its result, but run it
+        # ourselves if the lock disappears or expires without one.
+        deadline = time.monotonic() + config['LOCK_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(config['POLL_INTERVAL'])
+            result = cache.get(result_key)
+            if result is not None:
+                with self._lock:
+                    self.coalesced_remote += 1
+                return result
+            if cache.get(lock_key) is None:
+                break
+        return fn()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'coalesced_remote': self.coalesced_remote,
+                'in_flight': len(self._calls),
+            }
+
+
+search_flight = SingleFlight('search')
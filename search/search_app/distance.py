@@ -0,0 +1,192 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import requests
+from django.conf import settings
+
+from .adapters import AsyncGoogleDistanceMatrixAdapter, GoogleDistanceMatrixAdapter
+
+EARTH_RADIUS_M = 6371008.8
+
+# Small pool for distance work off the request thread: "estimate now, refine
+# async" upstream calls, and lookups that overlap with enrichment.
+_refine_executor = None
+_refine_lock = threading.Lock()
+
+
+def _get_refine_executor():
+    global _refine_executor
+    with _refine_lock:
+        if _refine_executor is None:
+            _refine_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='distance')
+    return _refine_executor
+
+
+def haversine_m(lat, lng, lats, lngs):
+    """Great-circle distance in metres from (lat, lng) to each of (lats, lngs)."""
+    lat1 = np.radians(lat)
+    lng1 = np.radians(lng)
+    lat2 = np.radians(np.asarray(lats, dtype=float))
+    lng2 = np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def estimate_walking(lat, lng, lats, lngs):
+    """
+    Estimate walking (distance_m, walking_time_min) pairs from the straight
+    line distance, inflated by WALKING_DETOUR_FACTOR for the street network.
+    """
+    distances = haversine_m(lat, lng, lats, lngs) * settings.WALKING_DETOUR_FACTOR
+    minutes = distances / settings.WALKING_SPEED_MPS // 60
+    return [(int(d), int(m)) for d, m in zip(distances, minutes)]
+
+
+def _apply_estimates(places, indices, user_lat, user_lng):
+    if not indices:
+        return
+    estimates = estimate_walking(
+        user_lat, user_lng,
+        [places[idx]['latitude'] for idx in indices],
+        [places[idx]['longitude'] for idx in indices],
+    )
+    for idx, (dist_m, walk_min) in zip(indices, estimates):
+        places[idx]['distance_m'] = dist_m
+        places[idx]['walking_time_min'] = walk_min
+        places[idx]['distance_estimated'] = True
+
+
+def _apply_elements(places, indices, dm_data):
+    """Copy Distance Matrix elements onto places; returns the indices it filled."""
+    if dm_data.get('status') != 'OK':
+        return []
+    return _apply_row(places, indices, dm_data.get('rows', [{}])[0].get('elements', []))
+
+
+def _apply_row(places, indices, elements):
+    filled = []
+    for idx, elem in zip(indices, elements):
+        if elem and elem.get('status') == 'OK':
+            places[idx]['distance_m'] = elem['distance']['value']
+            places[idx]['walking_time_min'] = int(elem['duration']['value'] // 60)
+            places[idx]['distance_estimated'] = False
+            filled.append(idx)
+    return filled
+
+
+def _located(places):
+    return [
+        idx for idx, place in enumerate(places)
+        if place.get('latitude') is not None and place.get('longitude') is not None
+    ]
+
+
+def _destinations(places, indices):
+    return [f"{places[idx]['latitude']},{places[idx]['longitude']}" for idx in indices]
+
+
+def fill_distances(places, user_lat, user_lng, mode=None, adapter=None):
+    """
+    Set 'distance_m' and 'walking_time_min' on each place according to
+    DISTANCE_MODE:
+
+    - 'upstream': Distance Matrix only; failures leave the fields empty.
+    - 'estimate': local haversine estimate only, no network call.
+    - 'estimate_refine': estimate now and fetch real values in the
+      background so the distance cache serves them to later searches.
+    - 'fallback': Distance Matrix, estimating whatever it could not fill.
+    """
+    mode = mode or settings.DISTANCE_MODE
+    adapter = adapter or GoogleDistanceMatrixAdapter()
+    indices = _located(places)
+    if not indices:
+        return
+
+    if mode in ('estimate', 'estimate_refine'):
+        _apply_estimates(places, indices, user_lat, user_lng)
+        if mode == 'estimate_refine':
+            _get_refine_executor().submit(
+                adapter.get_distances, f"{user_lat},{user_lng}", _destinations(places, indices)
+            )
+        return
+
+    try:
+        dm_data = adapter.get_distances(f"{user_lat},{user_lng}", _destinations(places, indices))
+    except requests.exceptions.RequestException:
+        dm_data = {}
+    filled = _apply_elements(places, indices, dm_data)
+    if mode == 'fallback':
+        _apply_estimates(places, [idx for idx in indices if idx not in filled], user_lat, user_lng)
+
+
+def fill_distances_batch(searches, mode=None, adapter=None):
+    """
+    fill_distances for many searches given as (places, user_lat, user_lng,
+    group) tuples. Searches in the same group, wherever their users stand,
+    have their origins sent together in multi-origin Distance Matrix
+    requests against the union of their destinations, so a batch costs a
+    request per group and chunk rather than one per search. Group searches
+    likely to share destinations, such as those for the same query.
+    """
+    mode = mode or settings.DISTANCE_MODE
+    adapter = adapter or GoogleDistanceMatrixAdapter()
+    if mode in ('estimate', 'estimate_refine'):
+        for places, user_lat, user_lng, _ in searches:
+            fill_distances(places, user_lat, user_lng, mode, adapter)
+        return
+
+    groups = {}
+    for places, user_lat, user_lng, group in searches:
+        indices = _located(places)
+        if indices:
+            groups.setdefault(group, []).append((places, indices, user_lat, user_lng))
+
+    for members in groups.values():
+        origins = list(dict.fromkeys(f"{lat},{lng}" for _, _, lat, lng in members))
+        destinations = list(dict.fromkeys(
+            dest for places, indices, _, _ in members for dest in _destinations(places, indices)
+        ))
+        positions = {dest: pos for pos, dest in enumerate(destinations)}
+        try:
+            rows = dict(zip(origins, adapter.get_distance_matrix(origins, destinations)))
+        except requests.exceptions.RequestException:
+            rows = {}
+        for places, indices, lat, lng in members:
+            row = rows.get(f"{lat},{lng}")
+            filled = []
+            if row is not None:
+                filled = _apply_row(places, indices, [row[positions[dest]] for dest in _destinations(places, indices)])
+            if mode == 'fallback':
+                _apply_estimates(places, [idx for idx in indices if idx not in filled], lat, lng)
+
+
+def submit_fill_distances(places, user_lat, user_lng, mode=None, adapter=None):
+    """Run fill_distances on the distance pool; returns its future."""
+    return _get_refine_executor().submit(fill_distances, places, user_lat, user_lng, mode, adapter)
+
+
+async def afill_distances(places, user_lat, user_lng, mode=None, adapter=None):
+    """fill_distances for async views, using the async Distance Matrix adapter."""
+    mode = mode or settings.DISTANCE_MODE
+    adapter = adapter or AsyncGoogleDistanceMatrixAdapter()
+    indices = _located(places)
+    if not indices:
+        return
+
+    if mode in ('estimate', 'estimate_refine'):
+        _apply_estimates(places, indices, user_lat, user_lng)
+        if mode == 'estimate_refine':
+            _get_refine_executor().submit(
+                GoogleDistanceMatrixAdapter().get_distances, f"{user_lat},{user_lng}", _destinations(places, indices)
+            )
+        return
+
+    try:
+        dm_data = await adapter.get_distances(f"{user_lat},{user_lng}", _destinations(places, indices))
+    except (requests.exceptions.RequestException, httpx.HTTPError):
+        dm_data = {}
+    filled = _apply_elements(places, indices, dm_data)
+    if mode == 'fallback':
+        _apply_estimates(places, [idx for idx in indices if idx not in filled], user_lat, user_lng)
@@ -0,0 +1,389 @@
+import contextvars
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .llm import ModelRegistry, get_registry
+from .models import PlaceEnrichment
+from .ratelimit import get_limiter
+
+logger = logging.getLogger(__name__)
+
+SCORE_PATTERN = re.compile(r"score(?: of)?:\s*([0-9.]+)", re.IGNORECASE)
+
+TEXT_FIELDS = ('description', 'review_summary')
+# What to give up, in order, when the Gemini rate limit can't cover a search.
+DEGRADE_ORDER = ('review_summary', 'description', 'score')
+
+# One pool per worker process, so the cap on in-flight Gemini calls is global
+# across every request the process is serving.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LLM_ENRICHMENT_MAX_WORKERS,
+                thread_name_prefix='gemini-enrichment',
+            )
+    return _executor
+
+
+# Enrichments run off the request thread (async searches and streams) wait
+# on their prompts from this pool, never from the Gemini pool, so waiting
+# searches can't take the workers their prompts need.
+_coordinator_executor = None
+_coordinator_lock = threading.Lock()
+
+
+def submit_enrichment(fn, *args):
+    """Run `fn(*args)` on the enrichment coordinator pool in the caller's context; returns its future."""
+    global _coordinator_executor
+    with _coordinator_lock:
+        if _coordinator_executor is None:
+            _coordinator_executor = ThreadPoolExecutor(
+                max_workers=settings.LLM_ENRICHMENT_MAX_WORKERS,
+                thread_name_prefix='enrichment-coordinator',
+            )
+    # Copy the context, as asyncio.to_thread does, so spans reach Server-Timing.
+    return _coordinator_executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def description_prompt(place):
+    # No query: descriptions are stored per place and reused by every search.
+    return f"Write a short description for {place['name']} at {place['address']}."
+
+
+def review_prompt(place):
+    return f"Summarize the reviews for {place['name']} at {place['address']}."
+
+
+def score_prompt(place, query):
+    return f"Give a score between 0 and 1 for {place['name']} at {place['address']} based on the search query {query}."
+
+
+def parse_score(text):
+    match = SCORE_PATTERN.search(text)
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            pass
+    return -1  # Default score if extraction fails
+
+
+def batch_prompt(places, query):
+    listing = "\n".join(
+        f"{idx}. {place['name']} at {place['address']}" for idx, place in enumerate(places)
+    )
+    return (
+        f"For each of the following places, write a short general description of the place "
+        f"(not tied to any search), summarize its reviews, and give a score between 0 and 1 for "
+        f"how well it matches the search query {query}.\n{listing}\n"
+        f"Respond only with a JSON array containing one object per place, of the form "
+        f'{{"index": <number from the list>, "description": "...", "review_summary": "...", "score": <0-1>}}.'
+    )
+
+
+# Shape every item of the batched response must have; anything else sends that
+# place back through the per-place prompts.
+BATCH_ITEM_SCHEMA = {
+    'index': int,
+    'description': str,
+    'review_summary': str,
+    'score': (int, float),
+}
+
+
+def parse_batch_response(text, count):
+    """
+    Parse the batched JSON reply into {index: item} for the items that match
+    BATCH_ITEM_SCHEMA. Malformed JSON yields an empty dict.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        # Strip a ```json ... ``` fence if the model added one.
+        text = text.strip("`")
+        if text.lower().startswith("json"):
+            text = text[4:]
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    valid = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if not all(
+            isinstance(item.get(key), expected) and not isinstance(item.get(key), bool)
+            for key, expected in BATCH_ITEM_SCHEMA.items()
+        ):
+            continue
+        if not 0 <= item['index'] < count or not 0 <= item['score'] <= 1:
+            continue
+        valid.setdefault(item['index'], item)
+    return valid
+
+
+def place_key(place):
+    """Identity of a place in the enrichment store: its Google place_id when known."""
+    if place.get('place_id'):
+        return place['place_id']
+    digest = hashlib.sha1(f"{place['name']}|{place['address']}".encode()).hexdigest()
+    return f"addr:{digest}"
+
+
+def load_enrichments(places):
+    """Return {index: PlaceEnrichment} for the places with fresh stored text."""
+    keys = {}
+    for idx, place in enumerate(places):
+        keys.setdefault(place_key(place), []).append(idx)
+    cutoff = timezone.now() - timedelta(seconds=settings.PLACE_ENRICHMENT_TTL)
+    rows = PlaceEnrichment.objects.filter(
+        place_key__in=keys, version=settings.PLACE_ENRICHMENT_VERSION, updated_at__gte=cutoff
+    )
+    return {idx: row for row in rows for idx in keys[row.place_key]}
+
+
+def store_enrichments(places, indices):
+    rows = {}
+    for idx in indices:
+        place = places[idx]
+        rows[place_key(place)] = PlaceEnrichment(
+            place_key=place_key(place),
+            description=place['description'],
+            review_summary=place['review_summary'],
+            version=settings.PLACE_ENRICHMENT_VERSION,
+            updated_at=timezone.now(),
+        )
+    if rows:
+        PlaceEnrichment.objects.bulk_create(
+            rows.values(),
+            update_conflicts=True,
+            unique_fields=['place_key'],
+            update_fields=['description', 'review_summary', 'version', 'updated_at'],
+        )
+
+
+class PlaceEnricher:
+    """
+    Fans the description, review summary and score prompts for every place
+    out to a bounded thread pool and waits for them up to a per-request
+    deadline, so a search costs roughly one model round-trip instead of 15.
+
+    In 'batched' mode a single JSON prompt covers every place instead; places
+    missing from or invalid in that reply fall back to the per-place prompts.
+
+    Descriptions and review summaries don't depend on the query, so with
+    `use_store` they are read from and saved to PlaceEnrichment, and only
+    the score is generated for places that already have them.
+
+    Places are expected best-first by the local ranker, which decides ties
+    and failed scores. Without `score` no score prompts are sent at all and
+    the first place is the best. The same happens, after first dropping
+    review summaries and then descriptions, when the Gemini rate limit
+    can't cover every prompt.
+
+    `model` answers every prompt; by default each prompt kind goes to its
+    model in the process-wide ModelRegistry instead.
+    """
+
+    def __init__(self, model=None, executor=None, timeout=None, mode=None, use_store=True, score=None):
+        if model is None:
+            model = get_registry()
+        self.models = model if isinstance(model, ModelRegistry) else None
+        self.model = model
+        self.executor = executor or get_executor()
+        self.timeout = settings.LLM_ENRICHMENT_TIMEOUT if timeout is None else timeout
+        self.mode = mode or settings.LLM_ENRICHMENT_MODE
+        self.use_store = use_store
+        self.score = settings.LLM_SCORING_ENABLED if score is None else score
+        self.limiter = get_limiter('gemini', settings.GEMINI_API_KEY)
+
+    def _generate(self, task, prompt, **kwargs):
+        model = self.models.get(task) if self.models is not None else self.model
+        with metrics.span('gemini'):
+            return model.generate_content(prompt, **kwargs).text
+
+    def enrich(self, places, query, scores=None):
+        """
+        Fill in 'description' and 'review_summary' on each place in-place and
+        return the index of the highest scoring place. A `scores` list, if
+        given, receives every place's score (-1 where none was obtained).
+        """
+        with metrics.span('enrich'):
+            for event, value in self.iter_enrich(places, query, scores):
+                if event == 'best':
+                    return value
+
+    def iter_enrich(self, places, query, scores=None):
+        """
+        Like enrich, but yields ('place', index) as soon as each place's text
+        and score are settled, and finally ('best', index).
+        """
+        deadline = time.monotonic() + self.timeout
+        if scores is None:
+            scores = []
+        scores[:] = [-1] * len(places)
+
+        stored = load_enrichments(places) if self.use_store else {}
+        for idx, row in stored.items():
+            places[idx]['description'] = row.description
+            places[idx]['review_summary'] = row.review_summary
+        needs_text = [idx for idx in range(len(places)) if idx not in stored]
+        generated = []
+
+        if self.mode == 'batched' and needs_text and self.limiter.acquire(count_throttled=False):
+            batched = self._enrich_batched([places[idx] for idx in needs_text], query, deadline)
+            for pos, item in batched.items():
+                idx = needs_text[pos]
+                places[idx]['description'] = item['description']
+                places[idx]['review_summary'] = item['review_summary']
+                if self.score:
+                    scores[idx] = float(item['score'])
+                generated.append(idx)
+                yield 'place', idx
+            needs_text = [idx for idx in needs_text if idx not in generated]
+
+        score_indices = needs_text + list(stored) if self.score else []
+        fields = self._affordable_fields(len(needs_text), len(score_indices))
+        if 'score' not in fields:
+            score_indices = []
+        text_fields = [field for field in TEXT_FIELDS if field in fields]
+        text_indices = needs_text if text_fields else []
+        for idx in range(len(places)):
+            if idx not in generated and idx not in text_indices and idx not in score_indices:
+                yield 'place', idx  # nothing (left) to generate
+        if text_indices or score_indices:
+            for idx, text_ok in self._iter_individually(
+                places, text_indices, text_fields, score_indices, query, scores, deadline
+            ):
+                if text_ok and idx not in stored:
+                    generated.append(idx)
+                yield 'place', idx
+
+        if self.use_store:
+            store_enrichments(places, generated)
+
+        best_index = 0
+        highest_score = -1
+        for idx, score in enumerate(scores):
+            if score > highest_score:
+                highest_score = score
+                best_index = idx
+        yield 'best', best_index
+
+    def _affordable_fields(self, text_count, score_count):
+        """
+        The prompt kinds the Gemini rate limit allows for this search, giving
+        them up in DEGRADE_ORDER until the rest fit. The prompts given up are
+        counted as throttled once, however many attempts it took.
+        """
+        costs = {'review_summary': text_count, 'description': text_count, 'score': score_count}
+        wanted = sum(costs.values())
+        for dropped in DEGRADE_ORDER:
+            cost = sum(costs.values())
+            if cost == 0 or self.limiter.acquire(cost, count_throttled=False):
+                break
+            metrics.inc('enrichment_degraded_total', dropped=dropped)
+            del costs[dropped]
+        else:
+            cost = 0
+        if cost < wanted:
+            self.limiter.throttle(wanted - cost)
+        return set(costs)
+
+    def _enrich_batched(self, places, query, deadline):
+        future = self.executor.submit(
+            self._generate,
+            'batch',
+            batch_prompt(places, query),
+            generation_config={'response_mime_type': 'application/json'},
+        )
+        try:
+            text = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            future.cancel()
+            metrics.inc('gemini_errors_total', prompt='batch')
+            logger.warning("Batched enrichment failed, falling back per place: %r", e)
+            return {}
+        return parse_batch_response(text, len(places))
+
+    def _iter_individually(self, places, text_indices, text_fields, score_indices, query, scores, deadline):
+        """
+        Generate `text_fields` for `text_indices` and the score for
+        `score_indices`, yielding (index, text_ok) as each place finishes;
+        text_ok means all of its text was generated.
+        """
+        jobs = {}
+        for idx in text_indices:
+            place = places[idx]
+            if 'description' in text_fields:
+                jobs[self.executor.submit(self._generate, 'description', description_prompt(place))] = (idx, 'description')
+            if 'review_summary' in text_fields:
+                jobs[self.executor.submit(self._generate, 'review_summary', review_prompt(place))] = (idx, 'review_summary')
+        for idx in score_indices:
+            jobs[self.executor.submit(self._generate, 'score', score_prompt(places[idx], query))] = (idx, 'score')
+        if len(text_fields) < len(TEXT_FIELDS):
+            failed = set(text_indices)  # partial text isn't worth storing
+        else:
+            failed = set()
+
+        remaining = {}
+        for idx, _ in jobs.values():
+            remaining[idx] = remaining.get(idx, 0) + 1
+        settled = set()
+
+        def settle(future, error):
+            settled.add(future)
+            idx, field = jobs[future]
+            if error is not None:
+                metrics.inc('gemini_errors_total', prompt=field)
+            if field == 'score':
+                if error is None:
+                    scores[idx] = parse_score(future.result())
+                else:
+                    logger.warning("Failed to get best score: %s", error)
+            elif error is None:
+                places[idx][field] = future.result()
+            else:
+                failed.add(idx)
+                if field == 'description':
+                    places[idx][field] = f"Failed to generate description: {error}"
+                else:
+                    places[idx][field] = f"Failed to generate review summary: {error}"
+            remaining[idx] -= 1
+            return idx if remaining[idx] == 0 else None
+
+        try:
+            for future in as_completed(jobs, timeout=max(deadline - time.monotonic(), 0)):
+                idx = settle(future, future.exception())
+                if idx is not None:
+                    yield idx, idx not in failed
+        except FuturesTimeoutError:
+            for future in jobs:
+                if future in settled:
+                    continue
+                if future.done():
+                    idx = settle(future, future.exception())
+                else:
+                    future.cancel()
+                    idx = settle(future, "timed out")
+                if idx is not None:
+                    yield idx, idx not in failed
@@ -0,0 +1,229 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+def upstream_name(url):
+    """
+    The upstream API a URL belongs to: its host and path, since Places and
+    Distance Matrix share maps.googleapis.com but fail independently.
+    """
+    parts = urlsplit(url)
+    return parts.netloc + parts.path
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds, then lets a single trial call through.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: push the window forward so only one caller probes.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of overall traffic: every request deposits
+    `ratio` tokens and every retry withdraws one, so a struggling upstream
+    is not hit with a multiple of the normal load.
+    """
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class UpstreamClient:
+    """
+    Process-wide HTTP client for the Google adapters: a pooled keep-alive
+    session with connect/read timeouts, jittered retries limited by a retry
+    budget, and a circuit breaker per upstream API.
+    """
+
+    def __init__(self, config):
+        self.connect_timeout = config['CONNECT_TIMEOUT']
+        self.read_timeout = config['READ_TIMEOUT']
+        self.max_retries = config['MAX_RETRIES']
+        self.backoff = config['BACKOFF']
+        self.failure_threshold = config['CIRCUIT_FAILURE_THRESHOLD']
+        self.reset_timeout = config['CIRCUIT_RESET_TIMEOUT']
+        self.retry_budget = RetryBudget(config['RETRY_BUDGET_RATIO'], config['RETRY_BUDGET_MAX'])
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config['POOL_SIZE'])
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def breaker(self, url):
+        upstream = upstream_name(url)
+        with self._breakers_lock:
+            if upstream not in self.breakers:
+                self.breakers[upstream] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[upstream]
+
+    def get(self, url, params=None):
+        host = urlsplit(url).netloc
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            metrics.inc('upstream_errors_total', host=host, reason='circuit_open')
+            raise CircuitOpenError(f"Circuit open for {upstream_name(url)}")
+
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            metrics.inc('upstream_requests_total', host=host)
+            try:
+                response = self.session.get(
+                    url, params=params, timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                metrics.inc('upstream_errors_total', host=host, reason='transport')
+                breaker.record_failure()
+                if not self.should_retry(attempt):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                metrics.inc('upstream_errors_total', host=host, reason=str(response.status_code))
+                breaker.record_failure()
+                if not self.should_retry(attempt):
+                    return response
+            attempt += 1
+            time.sleep(self.backoff_delay(attempt))
+
+    def should_retry(self, attempt):
+        """Whether attempt number `attempt` may be retried, spending a retry token if so."""
+        return attempt < self.max_retries and self.retry_budget.withdraw()
+
+    def backoff_delay(self, attempt):
+        # Full jitter: sleep anywhere up to the exponential backoff.
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+
+class AsyncUpstreamClient:
+    """
+    httpx-based counterpart of UpstreamClient for async views. It shares the
+    sync client's circuit breakers and retry budget, so both count against
+    the same upstream health.
+    """
+
+    def __init__(self, config, policy):
+        self.policy = policy
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config['READ_TIMEOUT'], connect=config['CONNECT_TIMEOUT']),
+            limits=httpx.Limits(max_connections=config['POOL_SIZE'], max_keepalive_connections=config['POOL_SIZE']),
+        )
+
+    async def get(self, url, params=None):
+        host = urlsplit(url).netloc
+        breaker = self.policy.breaker(url)
+        if not breaker.allow():
+            metrics.inc('upstream_errors_total', host=host, reason='circuit_open')
+            raise CircuitOpenError(f"Circuit open for {upstream_name(url)}")
+
+        self.policy.retry_budget.deposit()
+        attempt = 0
+        while True:
+            metrics.inc('upstream_requests_total', host=host)
+            try:
+                response = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                metrics.inc('upstream_errors_total', host=host, reason='transport')
+                breaker.record_failure()
+                if not self.policy.should_retry(attempt):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                metrics.inc('upstream_errors_total', host=host, reason=str(response.status_code))
+                breaker.record_failure()
+                if not self.policy.should_retry(attempt):
+                    return response
+            attempt += 1
+            await asyncio.sleep(self.policy.backoff_delay(attempt))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UpstreamClient(settings.UPSTREAM_HTTP)
+    return _client
+
+
+# httpx clients are bound to the event loop they were first used on.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client():
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncUpstreamClient(settings.UPSTREAM_HTTP, get_http_client())
+        with _client_lock:
+            _async_clients[loop] = client
+    return client
@@ -0,0 +1,39 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Work deferred past the response (see SearchPipeline.run's `defer`) runs on an
+# in-process pool, so no broker is needed. Jobs still queued when the process
+# exits are lost and their searches stay 'pending'.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SEARCH_JOB_WORKERS,
+                thread_name_prefix='search-jobs',
+            )
+    return _executor
+
+
+def _run(fn, args):
+    close_old_connections()
+    try:
+        fn(*args)
+    except Exception:
+        logger.exception("Background job %s failed", fn.__name__)
+    finally:
+        close_old_connections()
+
+
+def enqueue(fn, *args):
+    return get_job_executor().submit(_run, fn, args)
@@ -0,0 +1,91 @@
+import threading
+
+import google.generativeai as genai
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Prompt kinds that can each be routed to their own model.
+TASKS = ('description', 'review_summary', 'score', 'batch')
+
+
+def default_factory():
+    """
+    The callable building a model from its name: LLM_MODEL_FACTORY if set,
+    else genai.GenerativeModel. genai.configure resets the library's cached
+    API clients, so it runs here, once per registry, and never per search.
+    """
+    if settings.LLM_MODEL_FACTORY:
+        return import_string(settings.LLM_MODEL_FACTORY)
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return genai.GenerativeModel
+
+
+class ModelRegistry:
+    """
+    The model clients of one worker, one per distinct model name in
+    LLM_MODELS, built once and shared by every search and thread.
+    """
+
+    def __init__(self, config=None, factory=None):
+        self.config = config or settings.LLM_MODELS
+        self.factory = factory or default_factory()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def model_name(self, task):
+        """The model for `task`: its own entry, else SMALL if it is a SMALL_TASK, else DEFAULT."""
+        name = self.config['TASKS'].get(task)
+        if name:
+            return name
+        if task in self.config['SMALL_TASKS']:
+            return self.config['SMALL']
+        return self.config['DEFAULT']
+
+    def get(self, task):
+        name = self.model_name(task)
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._clients[name] = self.factory(name)
+        return client
+
+    def warm(self, connect=False):
+        """
+        Build every task's client now rather than on its first prompt. With
+        `connect`, each distinct client also makes one count_tokens call,
+        which opens its connection to the API without generating anything.
+        """
+        clients = {id(client): client for client in (self.get(task) for task in TASKS)}
+        if connect:
+            for client in clients.values():
+                client.count_tokens("ping")
+        return self
+
+    def stats(self):
+        return {task: self.model_name(task) for task in TASKS}
+
+
+# Settings a registry reads when it is built.
+REGISTRY_SETTINGS = {'GEMINI_API_KEY', 'LLM_MODEL_FACTORY', 'LLM_MODELS'}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide ModelRegistry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
+
+
+def reset_registry(setting=None, **kwargs):
+    """setting_changed receiver: rebuild the registry when its settings change."""
+    global _registry
+    if setting is None or setting in REGISTRY_SETTINGS:
+        with _registry_lock:
+            _registry = None
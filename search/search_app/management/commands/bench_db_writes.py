@@ -0,0 +1,79 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from search_app.models import SearchHistory
+from search_app.pipeline import save_search
+
+BENCH_QUERY = "__bench_db_writes__"
+
+
+def make_places(count):
+    return [
+        {
+            "name": f"Place {i}", "address": f"{i} Example Street", "rating": 4.0,
+            "user_ratings_count": 10, "description": "Description.", "review_summary": "Summary.",
+            "distance_m": 100 * i, "walking_time_min": i, "is_best": i == 0,
+        }
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Exercise the search insert path (SearchHistory + bulk_create of its "
+        "places) from concurrent threads against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--searches', type=int, default=50, help="Searches saved per thread.")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark rows afterwards.")
+
+    def handle(self, *args, **options):
+        places = make_places(5)
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(options['searches']):
+                    start = time.perf_counter()
+                    try:
+                        save_search(BENCH_QUERY, 35.6895, 139.6917, places)
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"{connection.vendor}, {options['threads']} threads x {options['searches']} searches")
+        if latencies:
+            latencies.sort()
+            self.stdout.write(
+                f"throughput={len(latencies) / elapsed:8.1f} searches/s  "
+                f"p50={statistics.median(latencies) * 1000:7.1f}ms  "
+                f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms"
+            )
+        if errors:
+            self.stdout.write(self.style.ERROR(f"{len(errors)} failed writes, e.g. {errors[0]!r}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("no failed writes"))
+
+        if not options['keep']:
+            SearchHistory.objects.filter(query=BENCH_QUERY).delete()
@@ -0,0 +1,96 @@
+import json
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from search_app.enrichment import PlaceEnricher
+
+# A stubbed model isn't a real quota, so benchmarks give it a Gemini limiter
+# of its own with no limits rather than spending (or tripping) the real one.
+BENCH_GEMINI_SETTINGS = {
+    'GEMINI_API_KEY': 'bench',
+    'UPSTREAM_RATE_LIMITS': {'gemini': {'RATE': 0, 'BURST': 0, 'BUDGET_PER_MINUTE': 0}},
+}
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Stands in for genai.GenerativeModel, sleeping `delay` seconds per call."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+        time.sleep(self.delay)
+        if prompt.startswith("Give a score"):
+            return StubResponse("Score: 0.5")
+        if prompt.startswith("For each of the following places"):
+            count = len(re.findall(r"^\d+\. ", prompt, re.MULTILINE))
+            return StubResponse(json.dumps([
+                {"index": i, "description": "Stub description.", "review_summary": "Stub summary.", "score": 0.5}
+                for i in range(count)
+            ]))
+        return StubResponse(f"Stub response for: {prompt}")
+
+
+def make_places(count):
+    return [
+        {"name": f"Place {i}", "address": f"{i} Example Street", "description": "", "review_summary": ""}
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Benchmark serial, concurrent and batched Gemini enrichment against a stubbed model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', type=float, default=0.2, help="Injected latency per model call (seconds).")
+        parser.add_argument('--places', type=int, default=5)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--workers', type=int, default=16, help="Concurrency cap for the concurrent run.")
+
+    def _bench(self, label, delay, executor, mode, places, runs):
+        model = StubModel(delay)
+        enricher = PlaceEnricher(model, executor=executor, timeout=3600, mode=mode, use_store=False)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            enricher.enrich(make_places(places), "ramen")
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(
+            f"{label:<12} p50={statistics.median(timings) * 1000:8.1f}ms  max={max(timings) * 1000:8.1f}ms  "
+            f"calls/search={model.calls / runs:5.1f}  prompt chars/search={model.prompt_chars / runs:7.0f}"
+        )
+        return statistics.median(timings)
+
+    @override_settings(**BENCH_GEMINI_SETTINGS)
+    def handle(self, *args, **options):
+        delay = options['delay']
+        places = options['places']
+        runs = options['runs']
+        self.stdout.write(f"{places} places, {delay * 1000:.0f}ms per call, {runs} runs")
+
+        with ThreadPoolExecutor(max_workers=1) as serial_pool:
+            serial = self._bench("serial", delay, serial_pool, 'concurrent', places, runs)
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            concurrent = self._bench("concurrent", delay, pool, 'concurrent', places, runs)
+            batched = self._bench("batched", delay, pool, 'batched', places, runs)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"speedup vs serial: concurrent {serial / concurrent:.1f}x, batched {serial / batched:.1f}x"
+        ))
@@ -0,0 +1,121 @@
+import statistics
+import threading
+import time
+
+import google.generativeai as genai
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from search_app.enrichment import PlaceEnricher
+from search_app.llm import ModelRegistry
+
+from .bench_enrichment import BENCH_GEMINI_SETTINGS, StubResponse, make_places
+
+
+class StubClient:
+    """
+    Stands in for genai.GenerativeModel: building one takes `setup` seconds,
+    its first call `connect` seconds more (the channel handshake) and every
+    generate_content call `delay` seconds.
+    """
+
+    builds = 0
+    _builds_lock = threading.Lock()
+
+    def __init__(self, name, setup, connect, delay):
+        with StubClient._builds_lock:
+            StubClient.builds += 1
+        time.sleep(setup)
+        self.name = name
+        self.connect = connect
+        self.delay = delay
+        self.connected = False
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            first, self.connected = not self.connected, True
+        return self.connect if first else 0
+
+    def count_tokens(self, contents):
+        time.sleep(self._open())
+        return StubResponse("")
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.delay + self._open())
+        if prompt.startswith("Give a score"):
+            return StubResponse("Score: 0.5")
+        return StubResponse(f"Stub response from {self.name}.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare enrichment latency with a model client built per search (cold) "
+        "against clients reused from a ModelRegistry, built at startup (built) or "
+        "also connected there with LLM_WARM_CONNECTIONS (warm), using a stub client."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--searches', type=int, default=20)
+        parser.add_argument('--places', type=int, default=5)
+        parser.add_argument('--setup', type=float, default=0.02, help="Seconds to build a client.")
+        parser.add_argument('--connect', type=float, default=0.1, help="Extra seconds on a client's first call.")
+        parser.add_argument('--delay', type=float, default=0.2, help="Seconds per model call.")
+        parser.add_argument('--small-tasks', default="",
+                            help="Comma-separated prompt kinds to route to the small model in the registry runs.")
+
+    def _bench(self, label, enricher_for_search, searches, places):
+        timings = []
+        for _ in range(searches):
+            start = time.perf_counter()
+            enricher_for_search().enrich(make_places(places), "ramen")
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(
+            f"{label:<6} p50={statistics.median(timings) * 1000:8.1f}ms  first={timings[0] * 1000:8.1f}ms  "
+            f"max={max(timings) * 1000:8.1f}ms  clients built={StubClient.builds}"
+        )
+        return statistics.median(timings)
+
+    @override_settings(**BENCH_GEMINI_SETTINGS)
+    def handle(self, *args, **options):
+        setup, connect, delay = options['setup'], options['connect'], options['delay']
+
+        def client(name):
+            return StubClient(name, setup, connect, delay)
+
+        def enricher(model):
+            return PlaceEnricher(model, timeout=3600, mode='concurrent', use_store=False, score=True)
+
+        self.stdout.write(
+            f"{options['searches']} searches of {options['places']} places; client setup {setup * 1000:.0f}ms, "
+            f"first call +{connect * 1000:.0f}ms, {delay * 1000:.0f}ms per call"
+        )
+        # What every search did before: configure and build a new model.
+        StubClient.builds = 0
+        cold = self._bench(
+            "cold", lambda: enricher(client(settings.LLM_MODELS['DEFAULT'])), options['searches'], options['places']
+        )
+        config = {
+            **settings.LLM_MODELS,
+            'SMALL_TASKS': [task for task in options['small_tasks'].split(',') if task],
+        }
+        StubClient.builds = 0
+        registry = ModelRegistry(config, factory=client).warm()
+        self._bench("built", lambda: enricher(registry), options['searches'], options['places'])
+        # Only the first search differs: it opens the connections that
+        # warm(connect=True) opened at startup.
+        StubClient.builds = 0
+        registry = ModelRegistry(config, factory=client).warm(connect=True)
+        warm = self._bench("warm", lambda: enricher(registry), options['searches'], options['places'])
+        self.stdout.write(f"models per task: {registry.stats()}")
+
+        # What building a real client costs, without any network traffic.
+        runs = 50
+        start = time.perf_counter()
+        for _ in range(runs):
+            genai.configure(api_key=settings.GEMINI_API_KEY or "bench")
+            genai.GenerativeModel(settings.LLM_MODELS['DEFAULT'])
+        self.stdout.write(f"genai configure + GenerativeModel: {(time.perf_counter() - start) / runs * 1000:.2f}ms")
+
+        self.stdout.write(self.style.SUCCESS(f"warm vs cold p50: {cold / warm:.2f}x faster"))
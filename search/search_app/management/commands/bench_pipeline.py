@@ -0,0 +1,113 @@
+import copy
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from search_app import replay
+from search_app.catalog import record_places
+from search_app.models import CatalogPlace, PlaceEnrichment, SearchHistory
+from search_app.pipeline import SearchPipeline, resolve_fanout
+
+from .bench_enrichment import BENCH_GEMINI_SETTINGS
+
+BENCH_QUERY = "__bench_pipeline__"
+STAGES = ('geolocate', 'places', 'rank', 'distance', 'enrich', 'persist', 'serialize')
+
+
+class Command(BaseCommand):
+    help = (
+        "Time each SearchPipeline stage on its own, with Places, Distance Matrix "
+        "and Gemini replayed in-process from recorded fixtures."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20, help="Runs per stage.")
+        parser.add_argument('--stages', default=",".join(STAGES), help="Comma-separated stages to time.")
+        parser.add_argument('--query', default="ramen")
+        parser.add_argument('--lat', type=float, default=35.6895)
+        parser.add_argument('--lng', type=float, default=139.6917)
+        parser.add_argument('--limit', type=int)
+        parser.add_argument('--radius', type=int)
+        parser.add_argument('--fixtures', default=str(replay.FIXTURES_DIR),
+                            help="Directory with places.json, distance_matrix.json and gemini.json.")
+        parser.add_argument('--gemini-latency', type=float, default=0.0, help="Seconds per Gemini call.")
+        parser.add_argument('--keep', action='store_true', help="Keep the rows written during the run.")
+
+    def handle(self, *args, **options):
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}")
+        if options['runs'] < 1:
+            raise CommandError("--runs must be positive.")
+        try:
+            fixtures = replay.load_fixtures(options['fixtures'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load fixtures: {e}")
+
+        model = replay.ReplayModel(fixtures, replay.Fault(options['gemini_latency']))
+        pipeline = SearchPipeline(
+            places_adapter=replay.ReplayPlacesAdapter(fixtures, on_fetch=record_places),
+            distance_adapter=replay.ReplayDistanceMatrixAdapter(fixtures),
+            model=model,
+        )
+        place_ids = [
+            place['place_id'] for response in fixtures['places'].values() for place in response.get('results', [])
+        ]
+        try:
+            with override_settings(**BENCH_GEMINI_SETTINGS):
+                timings = self._run(pipeline, stages, options)
+        finally:
+            if not options['keep']:
+                SearchHistory.objects.filter(query=BENCH_QUERY).delete()
+                PlaceEnrichment.objects.filter(place_key__in=place_ids).delete()
+                CatalogPlace.objects.filter(place_id__in=place_ids).delete()
+
+        self.stdout.write(f"{options['runs']} runs per stage, query {options['query']!r}")
+        for stage in stages:
+            values = sorted(timings[stage])
+            self.stdout.write(
+                f"{stage:<10} p50={statistics.median(values) * 1000:8.2f}ms  "
+                f"mean={statistics.mean(values) * 1000:8.2f}ms  max={values[-1] * 1000:8.2f}ms"
+            )
+        self.stdout.write(f"gemini calls {model.calls}")
+
+    def _run(self, pipeline, stages, options):
+        query = options['query']
+        runs = options['runs']
+        lat, lng = pipeline.geolocate(options['lat'], options['lng'])
+        limit, radius = resolve_fanout(options['limit'], options['radius'])
+
+        # Each stage is fed the output of the one before it, computed once up
+        # front, so it can be timed alone.
+        results = pipeline.places(query, lat, lng, radius)
+        ranked = pipeline.rank(results, query, lat, lng, radius, limit)
+        located = copy.deepcopy(ranked)
+        pipeline.distance(located, lat, lng)
+        enriched = copy.deepcopy(located)
+        pipeline.enrich(enriched, query)
+        search_record = pipeline.persist(BENCH_QUERY, lat, lng, enriched)
+
+        calls = {
+            'geolocate': lambda _: pipeline.geolocate(options['lat'], options['lng']),
+            'places': lambda _: pipeline.places(query, lat, lng, radius),
+            'rank': lambda _: pipeline.rank(results, query, lat, lng, radius, limit),
+            'distance': lambda places: pipeline.distance(places, lat, lng),
+            'enrich': lambda places: pipeline.enrich(places, query),
+            'persist': lambda _: pipeline.persist(BENCH_QUERY, lat, lng, enriched),
+            'serialize': lambda _: pipeline.serialize(search_record, enriched),
+        }
+        # Stages that fill in places in place get a fresh copy every run.
+        inputs = {'distance': ranked, 'enrich': located}
+
+        timings = {}
+        for stage in stages:
+            timings[stage] = []
+            for _ in range(runs):
+                places = copy.deepcopy(inputs[stage]) if stage in inputs else None
+                start = time.perf_counter()
+                calls[stage](places)
+                timings[stage].append(time.perf_counter() - start)
+        return timings
@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+from itertools import cycle
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from search_app import replay
+from search_app.models import CatalogPlace, PlaceEnrichment, SearchHistory
+
+ENDPOINTS = {
+    'search': '/api/search/',
+    'async': '/api/search/async/',
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def parse_server_timing(header):
+    """{stage: milliseconds} from a Server-Timing header."""
+    stages = {}
+    for entry in header.split(','):
+        name, _, params = entry.strip().partition(';')
+        if params.startswith('dur='):
+            stages[name] = float(params[4:])
+    return stages
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline load test: drive the search endpoint at a given concurrency with "
+        "Google and Gemini replayed from recorded fixtures by local stubs, and "
+        "report throughput, latency percentiles and DB queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Total searches to send.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='search')
+        parser.add_argument('--queries', default="ramen,sushi,coffee", help="Comma-separated queries to cycle through.")
+        parser.add_argument('--lat', type=float, default=35.6895)
+        parser.add_argument('--lng', type=float, default=139.6917)
+        parser.add_argument('--fixtures', default=str(replay.FIXTURES_DIR),
+                            help="Directory with places.json, distance_matrix.json and gemini.json.")
+        parser.add_argument('--upstream-latency', type=float, default=0.05, help="Seconds per Google call.")
+        parser.add_argument('--upstream-error-rate', type=float, default=0.0)
+        parser.add_argument('--gemini-latency', type=float, default=0.3, help="Seconds per Gemini call.")
+        parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+        parser.add_argument('--no-cache', action='store_true', help="Disable the upstream caches.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the injected errors.")
+        parser.add_argument('--json', dest='json_path', help="Write the report as JSON to this path, or only to stdout with '-'.")
+        parser.add_argument('--keep', action='store_true', help="Keep the searches written during the run.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive.")
+        try:
+            fixtures = replay.load_fixtures(options['fixtures'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load fixtures: {e}")
+
+        server = replay.StubUpstreamServer(
+            fixtures, replay.Fault(options['upstream_latency'], options['upstream_error_rate'], options['seed'])
+        ).start()
+        model = replay.ReplayModel(
+            fixtures, replay.Fault(options['gemini_latency'], options['gemini_error_rate'], options['seed'] + 1)
+        )
+        replay.install_replay_model(model)
+
+        overrides = {
+            'GOOGLE_PLACES_URL': server.base_url + replay.PLACES_PATH,
+            'GOOGLE_DISTANCE_MATRIX_URL': server.base_url + replay.DISTANCE_MATRIX_PATH,
+            'LLM_MODEL_FACTORY': 'search_app.replay.replay_model',
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],  # the test Client's host
+        }
+        if options['no_cache']:
+            overrides['SEARCH_CACHES'] = {
+                name: {**config, 'BACKEND': 'none'} for name, config in settings.SEARCH_CACHES.items()
+            }
+
+        # Every run starts with the recorded places unknown to the catalog and
+        # the enrichment store, so results are comparable between runs.
+        place_ids = [
+            place['place_id'] for response in fixtures['places'].values() for place in response.get('results', [])
+        ]
+        self._forget_places(place_ids)
+        # Ids of the searches the run stored, as its responses report them, so
+        # only those are removed and real traffic meanwhile is left alone.
+        created = []
+        try:
+            with override_settings(**overrides):
+                samples, elapsed = self._run(options, created)
+        finally:
+            server.stop()
+            replay.install_replay_model(None)
+            if not options['keep']:
+                SearchHistory.objects.filter(id__in=created).delete()
+                self._forget_places(place_ids)
+
+        report = self._report(options, samples, elapsed, server.requests, model.calls)
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self._print(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def _forget_places(self, place_ids):
+        PlaceEnrichment.objects.filter(place_key__in=place_ids).delete()
+        CatalogPlace.objects.filter(place_id__in=place_ids).delete()
+
+    def _run(self, options, created):
+        path = ENDPOINTS[options['endpoint']]
+        queries = cycle([q.strip() for q in options['queries'].split(',') if q.strip()])
+        next_lock = threading.Lock()
+        samples = []
+        remaining = [options['requests']]
+
+        def take():
+            with next_lock:
+                if remaining[0] == 0:
+                    return None, None
+                remaining[0] -= 1
+                return remaining[0], next(queries)
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    number, query = take()
+                    if query is None:
+                        break
+                    params = {'q': query, 'lat': options['lat'], 'lng': options['lng']}
+                    # Each request comes from its own address, so the per-client
+                    # throttle and response cache don't shape the results.
+                    address = f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+                    with CaptureQueriesContext(connection) as queries_run:
+                        start = time.perf_counter()
+                        response = client.get(path, params, REMOTE_ADDR=address)
+                        latency = time.perf_counter() - start
+                    stages = parse_server_timing(response.get('Server-Timing', ''))
+                    search_id = response.json().get('id') if response.status_code in (200, 202) else None
+                    with next_lock:
+                        samples.append((latency, response.status_code, len(queries_run), stages))
+                        if search_id is not None:
+                            created.append(search_id)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - start
+
+    def _report(self, options, samples, elapsed, upstream_requests, gemini_calls):
+        latencies = sorted(sample[0] for sample in samples)
+        query_counts = [sample[2] for sample in samples]
+        statuses = {}
+        stage_totals = {}
+        for _, code, _, stages in samples:
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+            for stage, duration in stages.items():
+                stage_totals[stage] = stage_totals.get(stage, 0.0) + duration
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        return {
+            'config': {
+                key: options[key] for key in (
+                    'endpoint', 'requests', 'concurrency', 'queries', 'upstream_latency',
+                    'upstream_error_rate', 'gemini_latency', 'gemini_error_rate', 'no_cache', 'seed',
+                )
+            },
+            'database': connection.vendor,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'p50': ms(percentile(latencies, 50)),
+                'p95': ms(percentile(latencies, 95)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1] if latencies else None),
+                'mean': ms(sum(latencies) / len(latencies) if latencies else None),
+            },
+            'db_queries_per_request': {
+                'mean': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+                'max': max(query_counts, default=None),
+            },
+            # Mean Server-Timing per request, in ms, for spotting which stage regressed.
+            'stage_ms': {stage: round(total / len(samples), 2) for stage, total in stage_totals.items()},
+            'status_codes': statuses,
+            'upstream_requests': dict(upstream_requests),
+            'gemini_calls': gemini_calls,
+        }
+
+    def _print(self, report):
+        latency = report['latency_ms']
+        queries = report['db_queries_per_request']
+        config = report['config']
+        self.stdout.write(
+            f"{config['endpoint']} endpoint, {config['requests']} requests at concurrency "
+            f"{config['concurrency']} ({report['database']})"
+        )
+        self.stdout.write(
+            f"throughput={report['throughput_rps']:8.1f} req/s  p50={latency['p50']:8.1f}ms  "
+            f"p95={latency['p95']:8.1f}ms  p99={latency['p99']:8.1f}ms"
+        )
+        self.stdout.write(f"db queries/request mean={queries['mean']} max={queries['max']}")
+        self.stdout.write("stages (ms/request): " + ", ".join(
+            f"{stage}={duration}" for stage, duration in report['stage_ms'].items()
+        ))
+        self.stdout.write(
+            f"status codes {report['status_codes']}, upstream requests {report['upstream_requests']}, "
+            f"gemini calls {report['gemini_calls']}"
+        )
+        if set(report['status_codes']) - {'200'}:
+            self.stdout.write(self.style.WARNING("some requests did not return 200"))
+        else:
+            self.stdout.write(self.style.SUCCESS("all requests returned 200"))
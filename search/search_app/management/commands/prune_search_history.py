@@ -0,0 +1,67 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from search_app.models import RecommendedPlace, SearchHistory, SearchRollup
+from search_app.query import canonical_query
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll searches older than --days up into daily per-query counts and "
+        "delete them with their places, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help="Keep searches newer than this many days.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this many batches.")
+        parser.add_argument('--no-rollup', action='store_true', help="Delete without recording SearchRollup counts.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old = SearchHistory.objects.filter(search_time__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{old.count()} searches older than {cutoff:%Y-%m-%d %H:%M} would be pruned.")
+            return
+
+        pruned = 0
+        batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            # Oldest first, so an interrupted run leaves a clean time boundary.
+            ids = list(old.order_by('search_time', 'id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            with transaction.atomic():
+                if not options['no_rollup']:
+                    self.rollup(ids)
+                RecommendedPlace.objects.filter(search_id__in=ids).delete()
+                SearchHistory.objects.filter(id__in=ids).delete()
+            pruned += len(ids)
+            batches += 1
+            self.stdout.write(f"Pruned {pruned} searches...")
+
+        self.stdout.write(self.style.SUCCESS(f"Pruned {pruned} searches older than {cutoff:%Y-%m-%d %H:%M}."))
+
+    def rollup(self, ids):
+        rows = (
+            SearchHistory.objects.filter(id__in=ids)
+            .annotate(day=TruncDate('search_time'))
+            .values('day', 'query')
+            .annotate(searches=Count('id'))
+        )
+        # Bucket by the canonical form searches are served under, so
+        # "Ramen near me" and "ramen" count as one query.
+        counts = Counter()
+        for row in rows:
+            counts[row['day'], canonical_query(row['query'])[:100]] += row['searches']
+        for (day, query), searches in counts.items():
+            updated = SearchRollup.objects.filter(day=day, query=query).update(searches=F('searches') + searches)
+            if not updated:
+                SearchRollup.objects.create(day=day, query=query, searches=searches)
@@ -0,0 +1,98 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from search_app.cache import geohash_encode
+from search_app.models import SearchHistory
+from search_app.pipeline import get_pipeline
+from search_app.query import canonical_query
+
+
+class Command(BaseCommand):
+    help = (
+        "Find the most frequent (query, area) pairs in recent search history "
+        "and run those searches, filling the Places, distance and enrichment "
+        "caches. Meant to be scheduled off-peak and after deploys. Caches "
+        "using the 'memory' backend live in each server process, so only "
+        "'django'-backed caches and the database-backed enrichment store and "
+        "catalog are shared with the servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-hours', type=float, default=24 * 7, help="How far back to mine history.")
+        parser.add_argument('--top-k', type=int, default=50)
+        parser.add_argument('--min-count', type=int, default=2, help="Ignore pairs searched fewer times.")
+        parser.add_argument(
+            '--precision', type=int, default=settings.SEARCH_CACHES['places']['GEOHASH_PRECISION'],
+            help="Geohash precision of the area cells (defaults to the Places cache's).",
+        )
+        parser.add_argument('--concurrency', type=int, default=2, help="Searches run at once.")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to wait after each search.")
+        parser.add_argument('--dry-run', action='store_true', help="List the pairs without running them.")
+        parser.add_argument('--force', action='store_true',
+                            help="Run even though the Places or distance cache is per-process ('memory').")
+
+    def popular_pairs(self, options):
+        since = timezone.now() - timedelta(hours=options['window_hours'])
+        groups = defaultdict(list)
+        rows = SearchHistory.objects.filter(search_time__gte=since).values_list('query', 'latitude', 'longitude')
+        for query, lat, lng in rows.iterator(chunk_size=2000):
+            key = (canonical_query(query), geohash_encode(lat, lng, options['precision']))
+            groups[key].append((lat, lng))
+
+        ranked = sorted(groups.items(), key=lambda item: len(item[1]), reverse=True)
+        pairs = []
+        for (query, cell), coords in ranked[:options['top_k']]:
+            if len(coords) < options['min_count']:
+                break
+            # Warm from where people actually searched, not the cell centre,
+            # so the finer-grained distance cache cells are hit too.
+            lat = sum(c[0] for c in coords) / len(coords)
+            lng = sum(c[1] for c in coords) / len(coords)
+            pairs.append((query, cell, lat, lng, len(coords)))
+        return pairs
+
+    def warm(self, pair, pause):
+        query, cell, lat, lng, count = pair
+        start = time.perf_counter()
+        try:
+            # Only stored text outlives the run; scores are per search, so
+            # warming doesn't pay for them.
+            _, status_code = get_pipeline().run(query, lat, lng, persist=False, score=False)
+        finally:
+            close_old_connections()
+        if pause:
+            time.sleep(pause)
+        return pair, status_code, time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        pairs = self.popular_pairs(options)
+        if not pairs:
+            self.stdout.write("No popular searches to warm.")
+            return
+
+        if options['dry_run']:
+            for query, cell, lat, lng, count in pairs:
+                self.stdout.write(f"{count:6d}  {query!r} @ {cell} ({lat:.5f},{lng:.5f})")
+            return
+
+        local = [name for name in ('places', 'distance') if settings.SEARCH_CACHES[name]['BACKEND'] == 'memory']
+        if local and not options['force']:
+            raise CommandError(
+                f"SEARCH_CACHES {' and '.join(local)} use the 'memory' backend, which lives in this process only, so "
+                "warming would not reach the servers. Use 'django' caches, or pass --force to warm the "
+                "enrichment store and catalog anyway."
+            )
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = pool.map(lambda pair: self.warm(pair, options['pause']), pairs)
+            for (query, cell, lat, lng, count), status_code, elapsed in results:
+                self.stdout.write(f"{status_code}  {elapsed * 1000:7.0f}ms  {query!r} @ {cell} ({count} searches)")
+
+        self.stdout.write(self.style.SUCCESS(f"Warmed {len(pairs)} searches."))
@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'search_stage_seconds': "Time spent in each stage of a search.",
+    'search_stage_errors_total': "Search stages that raised.",
+    'http_request_seconds': "Time to produce a response (streamed bodies excluded), by view.",
+    'upstream_requests_total': "HTTP requests sent to upstream APIs, retries included.",
+    'upstream_errors_total': "Failed upstream HTTP requests, by reason.",
+    'gemini_errors_total': "Failed or timed-out Gemini prompts, by prompt kind.",
+    'upstream_spend_total': "Upstream calls (Distance Matrix: elements) let through by the rate limiter.",
+    'upstream_throttled_total': "Upstream calls (Distance Matrix: elements) refused by the rate limiter.",
+    'enrichment_degraded_total': "Searches whose enrichment dropped a prompt kind to stay under the Gemini limit.",
+    'search_throttled_total': "Searches refused by the per-user or per-IP throttle, by scope.",
+    'search_cache_hits_total': "Upstream cache hits.",
+    'search_cache_misses_total': "Upstream cache misses.",
+    'search_cache_hit_ratio': "Upstream cache hit ratio since process start.",
+    'search_single_flight': "Search coalescing counters.",
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+# Process-wide registry, keyed by (metric name, sorted label items). Like the
+# cache stats, each worker process reports its own numbers.
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    histogram.observe(value)
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# Spans finished while serving the current request, for Server-Timing. Work
+# on the Gemini pool runs outside the request's context, so per-call spans
+# there only reach the histograms; the 'enrich' span covers them.
+_request_spans = ContextVar('search_request_spans', default=None)
+
+
+@contextmanager
+def span(stage):
+    """Time a block into search_stage_seconds and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc('search_stage_errors_total', stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('search_stage_seconds', elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def server_timing(spans, total):
+    """Server-Timing header value, summing repeated stages."""
+    durations = {}
+    for stage, elapsed in spans:
+        durations[stage] = durations.get(stage, 0.0) + elapsed
+    durations['total'] = total
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in durations.items())
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header listing the time spent in each search stage
+    and records the overall time per view in http_request_seconds.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self._finish(request, response, spans, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self._finish(request, response, spans, time.perf_counter() - start)
+
+    def _finish(self, request, response, spans, total):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        observe('http_request_seconds', total, view=view)
+        response['Server-Timing'] = server_timing(spans, total)
+        return response
+
+
+def _labels(items, **extra):
+    pairs = list(items) + sorted(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _header(lines, name, kind):
+    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render(cache_stats=None, flight_stats=None):
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    current = None
+    for (name, labels), histogram in histograms:
+        if name != current:
+            _header(lines, name, 'histogram')
+            current = name
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    current = None
+    for (name, labels), value in counters:
+        if name != current:
+            _header(lines, name, 'counter')
+            current = name
+        lines.append(f"{name}{_labels(labels)} {value}")
+
+    if cache_stats:
+        for metric, field, kind in (
+            ('search_cache_hits_total', 'hits', 'counter'),
+            ('search_cache_misses_total', 'misses', 'counter'),
+            ('search_cache_hit_ratio', 'hit_ratio', 'gauge'),
+        ):
+            _header(lines, metric, kind)
+            for cache_name, stats in sorted(cache_stats.items()):
+                lines.append(f'{metric}{{cache="{cache_name}"}} {stats[field]}')
+
+    if flight_stats:
+        _header(lines, 'search_single_flight', 'gauge')
+        for field, value in sorted(flight_stats.items()):
+            lines.append(f'search_single_flight{{field="{field}"}} {value}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_app', '0002_alter_recommendedplace_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceEnrichment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('place_key', models.CharField(max_length=255, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('review_summary', models.TextField(blank=True)),
+                ('version', models.IntegerField(default=1)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+# Full-text index over catalog names and keywords. SQLite only; on other
+# databases the catalog falls back to icontains matching.
+FTS_STATEMENTS = [
+    """CREATE VIRTUAL TABLE search_app_catalogplace_fts USING fts5(
+        name, keywords, content='search_app_catalogplace', content_rowid='id'
+    )""",
+    """CREATE TRIGGER search_app_catalogplace_ai AFTER INSERT ON search_app_catalogplace BEGIN
+        INSERT INTO search_app_catalogplace_fts(rowid, name, keywords) VALUES (new.id, new.name, new.keywords);
+    END""",
+    """CREATE TRIGGER search_app_catalogplace_ad AFTER DELETE ON search_app_catalogplace BEGIN
+        INSERT INTO search_app_catalogplace_fts(search_app_catalogplace_fts, rowid, name, keywords)
+        VALUES ('delete', old.id, old.name, old.keywords);
+    END""",
+    """CREATE TRIGGER search_app_catalogplace_au AFTER UPDATE ON search_app_catalogplace BEGIN
+        INSERT INTO search_app_catalogplace_fts(search_app_catalogplace_fts, rowid, name, keywords)
+        VALUES ('delete', old.id, old.name, old.keywords);
+        INSERT INTO search_app_catalogplace_fts(rowid, name, keywords) VALUES (new.id, new.name, new.keywords);
+    END""",
+]
+
+DROP_FTS_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS search_app_catalogplace_au",
+    "DROP TRIGGER IF EXISTS search_app_catalogplace_ad",
+    "DROP TRIGGER IF EXISTS search_app_catalogplace_ai",
+    "DROP TABLE IF EXISTS search_app_catalogplace_fts",
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in FTS_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_FTS_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_app', '0003_placeenrichment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogPlace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('place_id', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('address', models.CharField(max_length=255)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geohash', models.CharField(db_index=True, max_length=12)),
+                ('rating', models.FloatField(blank=True, null=True)),
+                ('user_ratings_total', models.IntegerField(blank=True, null=True)),
+                ('keywords', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
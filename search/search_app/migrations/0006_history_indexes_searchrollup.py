@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search_app', '0005_searchhistory_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('query', models.CharField(max_length=100)),
+                ('searches', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recommendedplace',
+            index=models.Index(condition=models.Q(('is_best', True)), fields=['search'], name='recplace_best_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['search_time'], name='searchhistory_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['query', 'search_time'], name='searchhistory_query_time_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'query'), name='searchrollup_day_query_uniq'),
+        ),
+    ]
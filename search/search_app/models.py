@@ -1,11 +1,24 @@
 from django.db import models
 
 class SearchHistory(models.Model):
+    PENDING = 'pending'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (COMPLETE, 'Complete'), (FAILED, 'Failed')]
+
     query = models.CharField(max_length=100)  # search term entered by the user
     latitude = models.FloatField()            # detected latitude of the user
     longitude = models.FloatField()           # detected longitude of the user
     search_time = models.DateTimeField(auto_now_add=True)  # timestamp of the search
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=COMPLETE)  # pending while enriched in the background
 
+    class Meta:
+        indexes = [
+            # History pages and the retention job scan by time.
+            models.Index(fields=['search_time'], name='searchhistory_time_idx'),
+            # Per-query history and popular-query mining.
+            models.Index(fields=['query', 'search_time'], name='searchhistory_query_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.query} @ ({self.latitude},{self.longitude})"
@@ -22,5 +35,49 @@ class RecommendedPlace(models.Model):
     walking_time_min = models.IntegerField(null=True, blank=True)  # walking time in minutes
     is_best = models.BooleanField(default=False)    # flag for the best recommended place
 
+    class Meta:
+        indexes = [
+            # Only one place per search is the best; index just those rows.
+            models.Index(fields=['search'], condition=models.Q(is_best=True), name='recplace_best_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} (Rating: {self.rating})"
+
+class SearchRollup(models.Model):
+    day = models.DateField()                         # UTC day the searches were made
+    query = models.CharField(max_length=100)         # canonical search term
+    searches = models.IntegerField(default=0)        # number of searches pruned into this bucket
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'query'], name='searchrollup_day_query_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.query} on {self.day}: {self.searches}"
+
+class PlaceEnrichment(models.Model):
+    place_key = models.CharField(max_length=255, unique=True)  # Google place_id, or a hash of name+address
+    description = models.TextField(blank=True)       # AI-generated description, reused across searches
+    review_summary = models.TextField(blank=True)    # AI-generated review summary, reused across searches
+    version = models.IntegerField(default=1)         # PLACE_ENRICHMENT_VERSION the text was generated under
+    updated_at = models.DateTimeField()              # when the text was last generated
+
+    def __str__(self):
+        return f"{self.place_key} (v{self.version})"
+
+class CatalogPlace(models.Model):
+    place_id = models.CharField(max_length=255, unique=True)  # Google place_id
+    name = models.CharField(max_length=255)
+    address = models.CharField(max_length=255)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geohash = models.CharField(max_length=12, db_index=True)  # spatial index: nearby places share a prefix
+    rating = models.FloatField(null=True, blank=True)
+    user_ratings_total = models.IntegerField(null=True, blank=True)
+    keywords = models.TextField(blank=True)          # place types and the queries it was found for
+    updated_at = models.DateTimeField(auto_now=True)  # last time Google returned this place
+
     def __str__(self):
-        return f"{self.name} (Rating: {self.rating})"
\ No newline at end of file
+        return f"{self.name} [{self.place_id}]"
@@ -0,0 +1,428 @@
+import asyncio
+import copy
+import threading
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+
+from .adapters import (
+    AsyncGoogleDistanceMatrixAdapter, AsyncGooglePlacesAdapter, GoogleDistanceMatrixAdapter, GooglePlacesAdapter,
+)
+from .cache import geohash_encode
+from .catalog import record_places, search_catalog
+from .distance import afill_distances, fill_distances, fill_distances_batch
+from .enrichment import PlaceEnricher, place_key, submit_enrichment
+from .jobs import enqueue
+from .metrics import span
+from .models import SearchHistory, RecommendedPlace
+from .query import canonical_query
+from .ranking import rank_results
+from .ratelimit import RateLimitExceeded
+from .serializers import SearchHistorySerializer
+
+DEFAULT_LOCATION = (35.6895, 139.6917)  # Example: Tokyo coordinates
+
+
+def resolve_location(lat, lng):
+    """Return (lat, lng) as floats, or the default location if either is missing."""
+    if lat and lng:
+        return float(lat), float(lng)  # ValueError on a malformed coordinate
+    return DEFAULT_LOCATION
+
+
+def resolve_fanout(limit, radius):
+    """
+    Return (limit, radius) from the request's values, defaulted and capped by
+    SEARCH_RESULTS. Raises ValueError on a malformed or non-positive value.
+    """
+    config = settings.SEARCH_RESULTS
+    limit = int(limit) if limit else config['DEFAULT_LIMIT']
+    radius = int(radius) if radius else config['DEFAULT_RADIUS']
+    if limit < 1 or radius < 1:
+        raise ValueError("limit and radius must be positive")
+    return min(limit, config['MAX_LIMIT']), min(radius, config['MAX_RADIUS'])
+
+
+def process_place(place):
+    """Flatten a Places API result into the dict returned to clients."""
+    loc = place.get('geometry', {}).get('location', {})
+    return {
+        "place_id": place.get('place_id'),
+        "name": place.get('name'),
+        "address": place.get('formatted_address') or place.get('vicinity', ''),
+        "rating": place.get('rating'),
+        "user_ratings_count": place.get('user_ratings_total'),
+        "latitude": loc.get('lat'),
+        "longitude": loc.get('lng'),
+        "description": "",
+        "review_summary": "",
+        "distance_m": None,
+        "walking_time_min": None,
+        "distance_estimated": False,
+        "is_best": False
+    }
+
+
+def select_places(results, query, user_lat, user_lng, radius, limit):
+    """
+    Rank raw results locally and process the top `limit`, best first. Only
+    these go on to distance lookups and enrichment.
+    """
+    return [process_place(place) for place in rank_results(results, query, user_lat, user_lng, radius, limit)]
+
+
+def mark_best(places, best_index):
+    if 0 <= best_index < len(places):
+        places[best_index]['is_best'] = True
+
+
+def save_search(query, user_lat, user_lng, places, status=SearchHistory.COMPLETE):
+    """Persist the search and its places; returns the SearchHistory row."""
+    # One transaction: a single commit, and a single write lock on SQLite.
+    with span('db_write'), transaction.atomic():
+        search_record = SearchHistory.objects.create(
+            query=query, latitude=user_lat, longitude=user_lng, search_time=timezone.now(), status=status
+        )
+        _bulk_create_places(search_record, places)
+    return search_record
+
+
+def save_places(search_record, places):
+    with span('db_write'):
+        _bulk_create_places(search_record, places)
+
+
+def _bulk_create_places(search_record, places):
+    RecommendedPlace.objects.bulk_create([
+        RecommendedPlace(
+            search=search_record,
+            name=place['name'],
+            address=place['address'],
+            rating=place.get('rating'),
+            user_ratings_count=place.get('user_ratings_count') or 0,
+            description=place.get('description', ''),
+            review_summary=place.get('review_summary', ''),
+            distance_m=place.get('distance_m'),
+            walking_time_min=place.get('walking_time_min'),
+            is_best=place.get('is_best', False)
+        )
+        for place in places
+    ])
+
+
+def serialize_search(search_record, places):
+    with span('serialize'):
+        data = SearchHistorySerializer(search_record).data
+    # Return the processed places rather than the stored rows, which lack
+    # coordinates.
+    data['places'] = places
+    return data
+
+
+def search_key(query, user_lat, user_lng, limit, radius):
+    """Searches with the same key are interchangeable and may share a result."""
+    precision = settings.SEARCH_CACHES['places']['GEOHASH_PRECISION']
+    return f"{canonical_query(query)}|{geohash_encode(user_lat, user_lng, precision)}|{limit}|{radius}"
+
+
+class SearchPipeline:
+    """
+    A search as explicit stages, each usable (and benchmarkable) on its own:
+
+    - geolocate: the user's coordinates, or the default location
+    - places: raw Places results, from the local catalog or Google
+    - rank: the `limit` best results by local score, flattened for clients
+    - distance: walking distance and time to each place
+    - enrich: descriptions, review summaries and the best place
+    - persist: the SearchHistory row and its places
+    - serialize: the response data
+
+    run(), arun() and run_batch() chain them for the views, and find() and
+    afind() run places and rank for the streaming views. The Places and
+    Distance Matrix adapters and the model are injected or default to
+    Google's and the process-wide ModelRegistry. Async stages use the async
+    adapters, or the sync ones from a worker thread when only those were
+    injected. A pipeline holds no per-search state and is meant to be
+    reused; see get_pipeline().
+    """
+
+    def __init__(self, places_adapter=None, distance_adapter=None, model=None,
+                 async_places_adapter=None, async_distance_adapter=None):
+        if async_places_adapter is None and places_adapter is None:
+            async_places_adapter = AsyncGooglePlacesAdapter(on_fetch=record_places)
+        if async_distance_adapter is None and distance_adapter is None:
+            async_distance_adapter = AsyncGoogleDistanceMatrixAdapter()
+        self.places_adapter = places_adapter or GooglePlacesAdapter(on_fetch=record_places)
+        self.distance_adapter = distance_adapter or GoogleDistanceMatrixAdapter()
+        self.async_places_adapter = async_places_adapter
+        self.async_distance_adapter = async_distance_adapter
+        self.model = model
+
+    def geolocate(self, lat, lng):
+        return resolve_location(lat, lng)
+
+    def _local_results(self, query, user_lat, user_lng, radius):
+        if settings.LOCAL_CATALOG['MODE'] != 'local_first':
+            return None
+        with span('catalog'):
+            results = search_catalog(query, user_lat, user_lng, radius)
+        if len(results) < settings.LOCAL_CATALOG['MIN_RESULTS']:
+            return None  # Coverage too thin; ask Google.
+        return results
+
+    def places(self, query, user_lat, user_lng, radius):
+        """
+        Places matching the query near the user: from the local catalog in
+        'local_first' mode when it has enough matches, otherwise from Google.
+        The default adapters add results fetched from Google, but not those
+        from their cache, to the catalog.
+        """
+        results = self._local_results(query, user_lat, user_lng, radius)
+        if results is None:
+            try:
+                results = self.places_adapter.search_places(query, f"{user_lat},{user_lng}", radius)
+            except RateLimitExceeded:
+                # Over the Places quota: whatever the catalog has beats an error.
+                results = search_catalog(query, user_lat, user_lng, radius)
+                if not results:
+                    raise
+        return results
+
+    async def aplaces(self, query, user_lat, user_lng, radius):
+        """places for async views."""
+        if self.async_places_adapter is None:
+            return await sync_to_async(self.places)(query, user_lat, user_lng, radius)
+        results = await sync_to_async(self._local_results)(query, user_lat, user_lng, radius)
+        if results is None:
+            try:
+                results = await self.async_places_adapter.search_places(query, f"{user_lat},{user_lng}", radius)
+            except RateLimitExceeded:
+                results = await sync_to_async(search_catalog)(query, user_lat, user_lng, radius)
+                if not results:
+                    raise
+        return results
+
+    def rank(self, results, query, user_lat, user_lng, radius, limit):
+        return select_places(results, query, user_lat, user_lng, radius, limit)
+
+    def distance(self, places, user_lat, user_lng):
+        fill_distances(places, user_lat, user_lng, adapter=self.distance_adapter)
+
+    async def adistance(self, places, user_lat, user_lng):
+        if self.async_distance_adapter is None:
+            await sync_to_async(self.distance)(places, user_lat, user_lng)
+        else:
+            await afill_distances(places, user_lat, user_lng, adapter=self.async_distance_adapter)
+
+    def enricher(self, score=None):
+        return PlaceEnricher(self.model, score=score)
+
+    def enrich(self, places, query, score=None):
+        """Fill in the generated fields of `places` in place and mark the best one."""
+        mark_best(places, self.enricher(score).enrich(places, query))
+
+    def persist(self, query, user_lat, user_lng, places, status=SearchHistory.COMPLETE):
+        return save_search(query, user_lat, user_lng, places, status)
+
+    def serialize(self, search_record, places):
+        return serialize_search(search_record, places)
+
+    def find(self, canonical, user_lat, user_lng, limit, radius):
+        """
+        The places and rank stages for a canonical query: (ranked places,
+        None), or (None, (response data, HTTP status)) when Places failed or
+        found nothing.
+        """
+        try:
+            results = self.places(canonical, user_lat, user_lng, radius)
+        except requests.exceptions.RequestException as e:
+            return None, ({"error": f"Places API request failed: {e}"}, status.HTTP_502_BAD_GATEWAY)
+        if not results:
+            return None, ({"message": "No places found for the given query."}, status.HTTP_200_OK)
+        return self.rank(results, canonical, user_lat, user_lng, radius, limit), None
+
+    async def afind(self, canonical, user_lat, user_lng, limit, radius):
+        """find for async views."""
+        try:
+            results = await self.aplaces(canonical, user_lat, user_lng, radius)
+        except (requests.exceptions.RequestException, httpx.HTTPError) as e:
+            return None, ({"error": f"Places API request failed: {e}"}, status.HTTP_502_BAD_GATEWAY)
+        if not results:
+            return None, ({"message": "No places found for the given query."}, status.HTTP_200_OK)
+        return self.rank(results, canonical, user_lat, user_lng, radius, limit), None
+
+    def run(self, query, user_lat, user_lng, defer=False, persist=True, limit=None, radius=None, score=None):
+        """
+        Run the full search; returns (response data, HTTP status). Up to `limit`
+        places within `radius` metres are returned (SEARCH_RESULTS defaults if
+        omitted). With `defer` the response carries the places and distances
+        only, and enrichment and persistence of the places finish on the job
+        pool. Without `persist` nothing is written to the search history,
+        which is how cache warming runs searches. `score` overrides
+        LLM_SCORING_ENABLED.
+        """
+        # Upstream calls and prompts use the canonical query, so equivalent
+        # searches share cache entries; the history keeps what the user typed.
+        canonical = canonical_query(query)
+        limit, radius = resolve_fanout(limit, radius)
+        places, response = self.find(canonical, user_lat, user_lng, limit, radius)
+        if places is None:
+            return response
+
+        # Distance Matrix and/or local estimate, depending on DISTANCE_MODE
+        self.distance(places, user_lat, user_lng)
+
+        if defer:
+            search_record = self.persist(query, user_lat, user_lng, [], status=SearchHistory.PENDING)
+            # The job fills in its places while the response is still to be
+            # rendered, so it gets its own copy.
+            enqueue(self.complete, search_record.id, canonical, copy.deepcopy(places))
+            return self.serialize(search_record, places), status.HTTP_202_ACCEPTED
+
+        self.enrich(places, canonical, score)
+
+        if not persist:
+            return {"query": query, "places": places}, status.HTTP_200_OK
+
+        search_record = self.persist(query, user_lat, user_lng, places)
+        return self.serialize(search_record, places), status.HTTP_200_OK
+
+    async def arun(self, query, user_lat, user_lng, limit=None, radius=None):
+        """
+        run for async views: upstream calls don't hold a worker thread, and
+        the distance lookup overlaps with enrichment once Places results
+        arrive.
+        """
+        canonical = canonical_query(query)
+        limit, radius = resolve_fanout(limit, radius)
+        places, response = await self.afind(canonical, user_lat, user_lng, limit, radius)
+        if places is None:
+            return response
+
+        # Distance and enrichment write disjoint keys of each place, so they can
+        # run side by side. Enrichment blocks on Gemini, so it waits on the
+        # coordinator pool and the event loop just awaits it.
+        await asyncio.gather(
+            self.adistance(places, user_lat, user_lng),
+            asyncio.wrap_future(submit_enrichment(self.enrich, places, canonical)),
+        )
+
+        search_record = await sync_to_async(self.persist)(query, user_lat, user_lng, places)
+        data = await sync_to_async(self.serialize)(search_record, places)
+        return data, status.HTTP_200_OK
+
+    def _enrich_group(self, items, query):
+        """
+        Enrich the places of searches that share a query once, over the union of
+        their places: text and scores don't depend on where the user stands.
+        """
+        union = {}
+        for item in items:
+            for place in item['places']:
+                union.setdefault(place_key(place), dict(place))
+        unique = list(union.values())
+        scores = []
+        self.enricher().enrich(unique, query, scores)
+        enriched = {place_key(place): (place, score) for place, score in zip(unique, scores)}
+
+        for item in items:
+            best_index, best_score = 0, -1
+            for idx, place in enumerate(item['places']):
+                source, score = enriched[place_key(place)]
+                place['description'] = source['description']
+                place['review_summary'] = source['review_summary']
+                # Places are best-first locally, so ties keep the local pick.
+                if score > best_score:
+                    best_index, best_score = idx, score
+            mark_best(item['places'], best_index)
+
+    def run_batch(self, items, limit=None, radius=None):
+        """
+        Run many searches as one: `items` are (query, lat, lng) tuples. Identical
+        queries from the same area share a Places lookup, and searches with the
+        same query share multi-origin Distance Matrix requests, whatever their
+        area, and one enrichment pass. Returns a list with, per item, the
+        stored search or an error/message, like run's response data.
+        """
+        limit, radius = resolve_fanout(limit, radius)
+        lookups = {}
+        searches = []
+        for query, user_lat, user_lng in items:
+            canonical = canonical_query(query)
+            key = search_key(canonical, user_lat, user_lng, limit, radius)
+            if key not in lookups:
+                try:
+                    lookups[key] = self.places(canonical, user_lat, user_lng, radius)
+                except requests.exceptions.RequestException as e:
+                    lookups[key] = e
+            searches.append({
+                'query': query, 'canonical': canonical, 'lat': user_lat, 'lng': user_lng,
+                'key': key, 'results': lookups[key], 'places': [],
+            })
+
+        found = [s for s in searches if s['results'] and not isinstance(s['results'], Exception)]
+        for search in found:
+            search['places'] = self.rank(
+                search['results'], search['canonical'], search['lat'], search['lng'], radius, limit
+            )
+        fill_distances_batch(
+            [(s['places'], s['lat'], s['lng'], s['canonical']) for s in found], adapter=self.distance_adapter
+        )
+
+        by_query = {}
+        for search in found:
+            by_query.setdefault(search['canonical'], []).append(search)
+        for canonical, group in by_query.items():
+            self._enrich_group(group, canonical)
+
+        response = []
+        with transaction.atomic():
+            for search in searches:
+                if isinstance(search['results'], Exception):
+                    response.append({"error": f"Places API request failed: {search['results']}"})
+                elif not search['results']:
+                    response.append({"message": "No places found for the given query."})
+                else:
+                    search_record = self.persist(search['query'], search['lat'], search['lng'], search['places'])
+                    response.append(self.serialize(search_record, search['places']))
+        return response
+
+    def complete(self, search_id, query, places):
+        """Enrich and persist the places of a deferred search."""
+        search_record = SearchHistory.objects.get(pk=search_id)
+        try:
+            self.enrich(places, query)
+            save_places(search_record, places)
+        except Exception:
+            SearchHistory.objects.filter(pk=search_id).update(status=SearchHistory.FAILED)
+            raise
+        SearchHistory.objects.filter(pk=search_id).update(status=SearchHistory.COMPLETE)
+
+
+# Settings the default adapters read when they are built.
+PIPELINE_SETTINGS = {'GOOGLE_MAPS_API_KEY', 'GOOGLE_PLACES_URL', 'GOOGLE_DISTANCE_MATRIX_URL'}
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """The process-wide SearchPipeline on the default adapters and model."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = SearchPipeline()
+        return _pipeline
+
+
+def reset_pipeline(setting=None, **kwargs):
+    """setting_changed receiver: rebuild the default pipeline when its adapters' settings change."""
+    global _pipeline
+    if setting is None or setting in PIPELINE_SETTINGS:
+        with _pipeline_lock:
+            _pipeline = None
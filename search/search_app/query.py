@@ -0,0 +1,32 @@
+import re
+
+from django.conf import settings
+
+_PUNCTUATION = re.compile(r"[^\w\s&'-]")
+
+
+def fold(text):
+    """Case- and whitespace-fold text."""
+    return " ".join(text.casefold().split())
+
+
+def canonical_query(query):
+    """
+    Map equivalent phrasings of a search to one canonical form, used both as
+    the query sent upstream and in every cache key: "Ramen ", "ramen near
+    me" and (through the synonyms table) "ramen shop" all become "ramen".
+
+    Steps: fold case, whitespace and punctuation; drop location phrases
+    (SEARCH_QUERY_STOP_PHRASES) which add nothing when coordinates are sent;
+    then apply the whole-query SEARCH_QUERY_SYNONYMS table. No other words
+    are dropped: the canonical form is what Google and Gemini search for,
+    and "pet store" is not "pet".
+    """
+    text = f" {fold(_PUNCTUATION.sub(' ', query))} "
+    for phrase in settings.SEARCH_QUERY_STOP_PHRASES:
+        text = text.replace(f" {phrase} ", " ")
+    canonical = " ".join(text.split())
+    if not canonical:
+        # Nothing but stop words; searching the folded text beats an empty query.
+        canonical = fold(query)
+    return settings.SEARCH_QUERY_SYNONYMS.get(canonical, canonical)
@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .distance import haversine_m
+from .query import fold
+
+# Ratings counts beyond this add nothing to the popularity signal.
+POPULARITY_SATURATION = 10_000
+
+
+def _rating_signal(rating, count, prior, prior_count):
+    # Bayesian average: a 5.0 from three reviews shouldn't beat a 4.6 from
+    # three thousand, so pull sparse ratings towards the prior.
+    if rating is None:
+        return prior / 5
+    return (rating * count + prior * prior_count) / (count + prior_count) / 5
+
+
+def _text_signal(place, terms):
+    if not terms:
+        return 0.0
+    words = set(fold(f"{place.get('name') or ''} {' '.join(place.get('types', []))}".replace("_", " ")).split())
+    return len(terms & words) / len(terms)
+
+
+def local_scores(results, query, user_lat, user_lng, radius):
+    """
+    Score raw Places results from what they already carry: rating (weighted
+    by its review count), popularity, distance within `radius` and how many
+    query terms the name and types match. Returns one score in [0, 1] per
+    result, weighted by SEARCH_RANKING['WEIGHTS'].
+    """
+    config = settings.SEARCH_RANKING
+    weights = config['WEIGHTS']
+    terms = set(fold(query).split())
+
+    located = []
+    for idx, place in enumerate(results):
+        loc = place.get('geometry', {}).get('location', {})
+        if loc.get('lat') is not None and loc.get('lng') is not None:
+            located.append((idx, loc['lat'], loc['lng']))
+    closeness = np.zeros(len(results))
+    if located:
+        indices, lats, lngs = zip(*located)
+        distances = haversine_m(user_lat, user_lng, lats, lngs)
+        closeness[list(indices)] = np.clip(1 - distances / radius, 0, 1)
+
+    scores = []
+    for idx, place in enumerate(results):
+        count = place.get('user_ratings_total') or 0
+        score = (
+            weights['rating'] * _rating_signal(
+                place.get('rating'), count, config['RATING_PRIOR'], config['RATING_PRIOR_COUNT']
+            )
+            + weights['popularity'] * min(math.log1p(count) / math.log1p(POPULARITY_SATURATION), 1.0)
+            + weights['distance'] * closeness[idx]
+            + weights['text'] * _text_signal(place, terms)
+        )
+        scores.append(float(score) / sum(weights.values()))
+    return scores
+
+
+def rank_results(results, query, user_lat, user_lng, radius, limit):
+    """The `limit` best raw results by local score, best first."""
+    scores = local_scores(results, query, user_lat, user_lng, radius)
+    # Ties keep Google's order.
+    order = sorted(range(len(results)), key=lambda idx: -scores[idx])
+    return [results[idx] for idx in order[:limit]]
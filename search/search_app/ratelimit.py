@@ -0,0 +1,177 @@
+import hashlib
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import caches as django_caches
+
+from . import metrics
+
+
+class RateLimitExceeded(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose rate limit or budget is spent."""
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; not shared across processes."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost):
+        """Take `cost` tokens if available; returns 0, or the seconds until they would be."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0
+            return (cost - self.tokens) / self.rate
+
+    def refund(self, cost):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + cost)
+
+
+class SharedBudget:
+    """
+    Calls per minute across every process sharing a Django cache alias,
+    counted with one key per minute window. With a per-process backend such
+    as LocMemCache the budget is per process too.
+    """
+
+    def __init__(self, name, per_minute, alias):
+        self.name = name
+        self.per_minute = per_minute
+        self.alias = alias
+
+    def _key(self):
+        return f"ratelimit:{self.name}:{int(time.time() // 60)}"
+
+    def spend(self, cost):
+        cache = django_caches[self.alias]
+        key = self._key()
+        cache.add(key, 0, timeout=120)
+        try:
+            spent = cache.incr(key, cost)
+        except ValueError:  # evicted between add and incr
+            cache.add(key, cost, timeout=120)
+            spent = cost
+        if spent > self.per_minute:
+            cache.decr(key, cost)
+            return False
+        return True
+
+    def spent(self):
+        return django_caches[self.alias].get(self._key(), 0)
+
+
+class UpstreamLimiter:
+    """
+    Rate limit for one upstream and API key: a local token bucket smooths
+    bursts from this process, and a shared per-minute budget keeps all
+    processes together under the quota.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.wait = config.get('WAIT', 0)
+        self.bucket = TokenBucket(config['RATE'], config['BURST']) if config['RATE'] else None
+        self.budget = (
+            SharedBudget(name, config['BUDGET_PER_MINUTE'], config['ALIAS']) if config['BUDGET_PER_MINUTE'] else None
+        )
+        self.spent = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1, wait=None, count_throttled=True):
+        """
+        Spend `cost` calls if the limits allow, waiting up to `wait` seconds
+        (the configured WAIT by default) for the local bucket to refill.
+        Returns whether the calls may go ahead. A caller retrying with a
+        smaller cost can pass `count_throttled=False` and report what it gave
+        up with `throttle` once.
+        """
+        wait = self.wait if wait is None else wait
+        allowed = self._take_local(cost, time.monotonic() + wait)
+        if allowed and self.budget is not None and not self.budget.spend(cost):
+            if self.bucket is not None:
+                self.bucket.refund(cost)
+            allowed = False
+
+        if allowed:
+            with self._lock:
+                self.spent += cost
+            metrics.inc('upstream_spend_total', cost, upstream=self.name)
+        elif count_throttled:
+            self.throttle(cost)
+        return allowed
+
+    def throttle(self, cost):
+        """Count `cost` calls as refused."""
+        with self._lock:
+            self.throttled += cost
+        metrics.inc('upstream_throttled_total', cost, upstream=self.name)
+
+    def _take_local(self, cost, deadline):
+        """
+        Take `cost` tokens from the bucket, at most a burst at a time so
+        costs above BURST can still be paid as it refills.
+        """
+        if self.bucket is None:
+            return True
+        if self.bucket.burst <= 0:
+            return False
+        taken = 0
+        while taken < cost:
+            chunk = min(self.bucket.burst, cost - taken)
+            delay = self.bucket.take(chunk)
+            if delay == 0:
+                taken += chunk
+                continue
+            if time.monotonic() + delay > deadline:
+                self.bucket.refund(taken)
+                return False
+            time.sleep(delay)
+        return True
+
+    def check(self, cost=1, wait=None):
+        """acquire, raising RateLimitExceeded when refused."""
+        if not self.acquire(cost, wait):
+            raise RateLimitExceeded(f"Rate limit exceeded for {self.name}")
+
+    def stats(self):
+        with self._lock:
+            stats = {'spent': self.spent, 'throttled': self.throttled}
+        if self.budget is not None:
+            stats['budget_per_minute'] = self.budget.per_minute
+            stats['spent_this_minute'] = self.budget.spent()
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream, api_key):
+    """The process-wide limiter for `upstream` ('places', 'distance_matrix' or 'gemini') and key."""
+    key_id = hashlib.sha1((api_key or '').encode()).hexdigest()[:8]
+    name = f"{upstream}:{key_id}"
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = UpstreamLimiter(name, settings.UPSTREAM_RATE_LIMITS[upstream])
+        return _limiters[name]
+
+
+def limiter_stats():
+    with _limiters_lock:
+        return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -0,0 +1,236 @@
+"""
+Offline stand-ins for the upstream APIs, replaying recorded responses.
+
+`StubUpstreamServer` serves Places Text Search and Distance Matrix fixtures
+over local HTTP, and `ReplayModel` answers Gemini prompts from a fixture,
+both with injected latency and error rates. Point GOOGLE_PLACES_URL and
+GOOGLE_DISTANCE_MATRIX_URL at the server and LLM_MODEL_FACTORY at
+`replay_model` to run searches without network access.
+
+`ReplayPlacesAdapter` and `ReplayDistanceMatrixAdapter` answer from the
+same fixtures in-process, for injecting into a SearchPipeline.
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+PLACES_PATH = '/maps/api/place/textsearch/json'
+DISTANCE_MATRIX_PATH = '/maps/api/distancematrix/json'
+
+
+def load_fixtures(directory=FIXTURES_DIR):
+    directory = Path(directory)
+    return {
+        name: json.loads((directory / f'{name}.json').read_text())
+        for name in ('places', 'distance_matrix', 'gemini')
+    }
+
+
+class Fault:
+    """Latency (seconds) and error rate injected into each stubbed call."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        """Sleep for the latency; returns True if this call should fail."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+def _stable_pick(options, key):
+    # Same key, same answer, across runs and processes.
+    return options[zlib.crc32(key.encode()) % len(options)]
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like Google
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == PLACES_PATH:
+            body = server.places_response(params)
+        elif url.path == DISTANCE_MATRIX_PATH:
+            body = server.distance_matrix_response(params)
+        else:
+            return self._send(404, {'status': 'NOT_FOUND'})
+        server.count(url.path)
+        if server.fault.apply():
+            return self._send(503, {'status': 'UNKNOWN_ERROR'})
+        self._send(200, body)
+
+    def _send(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubUpstreamServer(ThreadingHTTPServer):
+    """Local HTTP server replaying Places and Distance Matrix fixtures."""
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, fault=None):
+        super().__init__(('127.0.0.1', 0), _UpstreamHandler)
+        self.fixtures = fixtures
+        self.fault = fault or Fault()
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, path):
+        name = 'places' if path == PLACES_PATH else 'distance_matrix'
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def places_response(self, params):
+        # Recordings are keyed by query; anything else gets the 'default' one.
+        places = self.fixtures['places']
+        return places.get(params.get('query', '').lower(), places['default'])
+
+    def distance_matrix_response(self, params):
+        elements = self.fixtures['distance_matrix']['elements']
+        destinations = params.get('destinations', '').split('|')
+        origins = params.get('origins', '').split('|')
+        return {
+            'status': 'OK',
+            'rows': [
+                {'elements': [_stable_pick(elements, f"{origin}|{destination}") for destination in destinations]}
+                for origin in origins
+            ],
+        }
+
+
+class ReplayPlacesAdapter:
+    """Stands in for GooglePlacesAdapter, without HTTP or caching, so every call is a fetch."""
+
+    def __init__(self, fixtures, on_fetch=None):
+        self.fixtures = fixtures
+        self.on_fetch = on_fetch
+
+    def search_places(self, query, location, radius=5000):
+        places = self.fixtures['places']
+        results = places.get(query.lower(), places['default']).get('results', [])
+        if self.on_fetch is not None:
+            self.on_fetch(results, query)
+        return results
+
+
+class ReplayDistanceMatrixAdapter:
+    """Stands in for GoogleDistanceMatrixAdapter, without HTTP or caching."""
+
+    def __init__(self, fixtures):
+        self.elements = fixtures['distance_matrix']['elements']
+
+    def get_distance_matrix(self, origins, destinations, mode='walking', units='metric'):
+        return [
+            [_stable_pick(self.elements, f"{origin}|{destination}") for destination in destinations]
+            for origin in origins
+        ]
+
+    def get_distances(self, origins, destinations, mode='walking', units='metric'):
+        rows = self.get_distance_matrix(origins.split('|'), destinations, mode, units)
+        return {'status': 'OK', 'rows': [{'elements': row} for row in rows]}
+
+
+class _ReplayResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _ReplayCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+class ReplayModel:
+    """
+    Stands in for genai.GenerativeModel, answering each prompt with a
+    recorded response picked by prompt kind and place.
+    """
+
+    def __init__(self, fixtures, fault=None):
+        self.responses = fixtures['gemini']
+        self.fault = fault or Fault()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.fault.apply():
+            raise RuntimeError("503 Injected Gemini failure")
+        if prompt.startswith("For each of the following places"):
+            return _ReplayResponse(self._batch(prompt))
+        if prompt.startswith("Give a score"):
+            kind = 'score'
+        elif prompt.startswith("Summarize the reviews"):
+            kind = 'review_summary'
+        else:
+            kind = 'description'
+        return _ReplayResponse(_stable_pick(self.responses[kind], prompt))
+
+    def count_tokens(self, contents):
+        return _ReplayCount(len(str(contents).split()))
+
+    def _batch(self, prompt):
+        items = []
+        for line in prompt.splitlines():
+            number, sep, place = line.partition('. ')
+            if not sep or not number.isdigit():
+                continue
+            items.append({
+                'index': int(number),
+                'description': _stable_pick(self.responses['description'], place),
+                'review_summary': _stable_pick(self.responses['review_summary'], place),
+                'score': float(_stable_pick(self.responses['score'], place).rpartition(' ')[2]),
+            })
+        return json.dumps(items)
+
+
+_model = None
+
+
+def install_replay_model(model):
+    global _model
+    _model = model
+
+
+def replay_model(model_name=None):
+    """LLM_MODEL_FACTORY target returning the installed ReplayModel, whatever the model name."""
+    if _model is None:
+        raise RuntimeError("No replay model installed; call install_replay_model() first.")
+    return _model
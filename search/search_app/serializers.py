@@ -14,12 +14,17 @@ class SearchHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = SearchHistory
         fields = ['id', 'query', 'latitude', 'longitude', 
-                  'search_time', 'places']
+                  'search_time', 'status', 'places']
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        # Add the best recommendation manually.
-        best_place = instance.places.filter(is_best=True).first()
+        # Add the best recommendation manually, from the `best_places`
+        # prefetch when the queryset provides one.
+        best_places = getattr(instance, 'best_places', None)
+        if best_places is not None:
+            best_place = best_places[0] if best_places else None
+        else:
+            best_place = instance.places.filter(is_best=True).first()
         representation['best_recommendation'] = (
             RecommendedPlaceSerializer(best_place).data if best_place else None
         )
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import queue
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from .distance import submit_fill_distances
+from .enrichment import submit_enrichment
+from .pipeline import mark_best
+from .query import canonical_query
+
+NDJSON = 'application/x-ndjson'
+SSE = 'text/event-stream'
+
+DISTANCE_FIELDS = ('distance_m', 'walking_time_min', 'distance_estimated')
+ENRICHMENT_FIELDS = ('description', 'review_summary')
+
+logger = logging.getLogger(__name__)
+
+
+def encode(event, data, content_type):
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    if content_type == SSE:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({'event': event, 'data': data}, cls=DjangoJSONEncoder) + "\n"
+
+
+def _patch(places, idx, fields):
+    return {'index': idx, **{field: places[idx][field] for field in fields}}
+
+
+def _distance_patches(places):
+    return [_patch(places, idx, DISTANCE_FIELDS) for idx in range(len(places))]
+
+
+def _done(search_record):
+    return {'id': search_record.id, 'search_time': search_record.search_time}
+
+
+def _error(error, content_type):
+    # The response has started, so a failure can only be reported in-band.
+    logger.error("Streamed search failed: %r", error)
+    return encode('error', {'error': f"Search failed: {error}"}, content_type)
+
+
+def _pump(events, queue):
+    """Feed the enrichment events into `queue`, ending with ('end', None) or ('error', exception)."""
+    try:
+        for item in events:
+            queue.put(item)
+        queue.put(('end', None))
+    except Exception as e:
+        queue.put(('error', e))
+    finally:
+        connections.close_all()
+
+
+def stream_search(pipeline, query, user_lat, user_lng, places, content_type):
+    """
+    Stream a search whose ranked Places results are already in `places`,
+    running the rest of `pipeline`'s stages: the raw list, distance patches
+    and per-place enrichment patches as they finish, the best place, and
+    finally the stored search id.
+    """
+    yield encode('places', {'query': query, 'latitude': user_lat, 'longitude': user_lng, 'places': places}, content_type)
+
+    # Distances and enrichment run side by side and report to one queue, so
+    # whichever finishes first is sent first.
+    events = queue.Queue()
+    distances = submit_fill_distances(places, user_lat, user_lng, adapter=pipeline.distance_adapter)
+    distances.add_done_callback(lambda _: events.put(('distances', None)))
+    enrichment = pipeline.enricher().iter_enrich(places, canonical_query(query))
+    submit_enrichment(_pump, enrichment, events)
+
+    pending = 2
+    while pending:
+        event, idx = events.get()
+        if event == 'distances':
+            if distances.exception() is not None:
+                yield _error(distances.exception(), content_type)
+                return
+            for patch in _distance_patches(places):
+                yield encode('distance', patch, content_type)
+            pending -= 1
+        elif event == 'place':
+            yield encode('enrichment', _patch(places, idx, ENRICHMENT_FIELDS), content_type)
+        elif event == 'best':
+            best_index = idx
+        elif event == 'end':
+            pending -= 1
+        else:
+            yield _error(idx, content_type)
+            return
+
+    mark_best(places, best_index)
+    yield encode('best', {'index': best_index}, content_type)
+
+    search_record = pipeline.persist(query, user_lat, user_lng, places)
+    yield encode('done', _done(search_record), content_type)
+
+
+async def astream_search(pipeline, query, user_lat, user_lng, places, content_type):
+    """stream_search for async views."""
+    yield encode('places', {'query': query, 'latitude': user_lat, 'longitude': user_lng, 'places': places}, content_type)
+
+    distances = asyncio.ensure_future(pipeline.adistance(places, user_lat, user_lng))
+
+    # The enrichment generator blocks on the Gemini pool and reads the
+    # enrichment store, so step it from a worker thread, and wait on it and
+    # the distances together.
+    events = pipeline.enricher().iter_enrich(places, canonical_query(query))
+    next_event = sync_to_async(next)
+    stepping = asyncio.ensure_future(next_event(events, (None, None)))
+    pending = {distances, stepping}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        failed = next((task.exception() for task in done if task.exception() is not None), None)
+        if failed is not None:
+            for task in pending:
+                task.cancel()
+            yield _error(failed, content_type)
+            return
+        if distances in done:
+            for patch in _distance_patches(places):
+                yield encode('distance', patch, content_type)
+        if stepping in done:
+            event, idx = stepping.result()
+            if event is None:
+                continue
+            if event == 'place':
+                yield encode('enrichment', _patch(places, idx, ENRICHMENT_FIELDS), content_type)
+            else:
+                best_index = idx
+            stepping = asyncio.ensure_future(next_event(events, (None, None)))
+            pending.add(stepping)
+
+    mark_best(places, best_index)
+    yield encode('best', {'index': best_index}, content_type)
+
+    search_record = await sync_to_async(pipeline.persist)(query, user_lat, user_lng, places)
+    yield encode('done', _done(search_record), content_type)
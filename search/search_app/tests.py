@@ -1,3 +1,873 @@
-from django.test import TestCase
+import contextvars
+import json
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import replay
+from .adapters import GoogleDistanceMatrixAdapter, GooglePlacesAdapter
+from .cache import DjangoCache, get_cache, hashed_key
+from .catalog import record_places, search_catalog
+from .coalesce import SingleFlight
+from .enrichment import PlaceEnricher, parse_batch_response, submit_enrichment
+from .http_client import CircuitBreaker, CircuitOpenError, RetryBudget, UpstreamClient
+from .llm import ModelRegistry
+from .management.commands.loadtest import Command as LoadTestCommand
+from .models import CatalogPlace, SearchHistory, SearchRollup, RecommendedPlace
+from .pipeline import SearchPipeline
+from .query import canonical_query
+from .streaming import NDJSON, astream_search, stream_search
+from .ranking import rank_results
+from .ratelimit import UpstreamLimiter
+from .throttling import SlidingWindow, sliding_window_usage
+
+
+class SearchHistoryListViewTests(TestCase):
+    def create_searches(self, count):
+        for i in range(count):
+            search = SearchHistory.objects.create(query=f"ramen {i}", latitude=35.69, longitude=139.69)
+            RecommendedPlace.objects.bulk_create([
+                RecommendedPlace(search=search, name=f"Place {j}", address=f"{j} Street", is_best=(j == 2))
+                for j in range(5)
+            ])
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.create_searches(10)
+        url = reverse('search-history')
+        for page_size in (1, 10):
+            # Page, places prefetch, best place prefetch.
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_includes_best_recommendation(self):
+        self.create_searches(1)
+        response = self.client.get(reverse('search-history'))
+        result = response.data['results'][0]
+        self.assertEqual(len(result['places']), 5)
+        self.assertEqual(result['best_recommendation']['name'], "Place 2")
+
+    def test_cursor_pages_are_newest_first_and_disjoint(self):
+        self.create_searches(5)
+        url = reverse('search-history')
+        first = self.client.get(url, {'page_size': 3}).data
+        second = self.client.get(first['next']).data
+        ids = [r['id'] for r in first['results']] + [r['id'] for r in second['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(set(ids)), 5)
+
+
+class SearchDetailViewTests(TestCase):
+    def setUp(self):
+        self.search = SearchHistory.objects.create(
+            query="ramen", latitude=35.69, longitude=139.69, status=SearchHistory.PENDING
+        )
+        self.url = reverse('search-detail', args=[self.search.pk])
+
+    def test_rejects_invalid_wait(self):
+        for wait in ("nan", "inf", "-inf", "abc"):
+            response = self.client.get(self.url, {'wait': wait})
+            self.assertEqual(response.status_code, 400, wait)
+
+    def test_negative_wait_returns_at_once(self):
+        start = time.monotonic()
+        response = self.client.get(self.url, {'wait': -5})
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(response.data['status'], SearchHistory.PENDING)
+
+    @override_settings(SEARCH_LONG_POLL_MAX=0.3, SEARCH_LONG_POLL_INTERVAL=0.05)
+    def test_wait_is_capped_for_a_search_that_stays_pending(self):
+        start = time.monotonic()
+        response = self.client.get(self.url, {'wait': 60})
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(response.data['status'], SearchHistory.PENDING)
+
+    def test_wait_returns_once_the_search_completes(self):
+        def background_job_finishes(seconds):
+            SearchHistory.objects.filter(pk=self.search.pk).update(status=SearchHistory.COMPLETE)
+
+        with mock.patch('search_app.views.time.sleep', side_effect=background_job_finishes) as sleep:
+            response = self.client.get(self.url, {'wait': 10})
+        self.assertEqual(response.data['status'], SearchHistory.COMPLETE)
+        self.assertEqual(sleep.call_count, 1)
+
+
+class SearchParameterTests(TestCase):
+    def test_every_search_endpoint_rejects_bad_parameters_alike(self):
+        cases = [
+            ({}, "No search query provided."),
+            ({'q': 'ramen', 'lat': 'north', 'lng': '139.69'}, "Invalid latitude/longitude format."),
+            ({'q': 'ramen', 'limit': 'many'}, "Invalid limit/radius."),
+        ]
+        for name in ('place-search', 'place-search-stream', 'place-search-async', 'place-search-async-stream'):
+            for params, error in cases:
+                response = self.client.get(reverse(name), params)
+                self.assertEqual(response.status_code, 400, (name, params))
+                self.assertEqual(json.loads(response.content), {'error': error}, (name, params))
+
+
+class DeferredSearchTests(TestCase):
+    def setUp(self):
+        fixtures = replay.load_fixtures()
+        self.pipeline = SearchPipeline(
+            places_adapter=replay.ReplayPlacesAdapter(fixtures),
+            distance_adapter=replay.ReplayDistanceMatrixAdapter(fixtures),
+            model=replay.ReplayModel(fixtures),
+        )
+        patcher = mock.patch('search_app.pipeline.enqueue')
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_job(self):
+        fn, *args = self.enqueue.call_args.args
+        fn(*args)
+
+    def test_search_is_pending_until_its_job_completes(self):
+        data, status_code = self.pipeline.run("ramen", 35.6895, 139.6917, defer=True)
+        self.assertEqual(status_code, 202)
+        self.assertEqual(data['status'], SearchHistory.PENDING)
+        self.assertTrue(all(place['distance_m'] is not None for place in data['places']))
+        self.assertFalse(any(place.get('description') for place in data['places']))
+        search_record = SearchHistory.objects.get(pk=data['id'])
+        self.assertFalse(search_record.places.exists())
+
+        self.run_job()
+        search_record.refresh_from_db()
+        self.assertEqual(search_record.status, SearchHistory.COMPLETE)
+        self.assertEqual(search_record.places.count(), len(data['places']))
+        self.assertEqual(search_record.places.filter(is_best=True).count(), 1)
+
+    def test_failed_job_marks_the_search_failed(self):
+        data, _ = self.pipeline.run("ramen", 35.6895, 139.6917, defer=True)
+        with mock.patch.object(self.pipeline, 'enrich', side_effect=RuntimeError("model down")):
+            with self.assertRaises(RuntimeError):
+                self.run_job()
+        self.assertEqual(SearchHistory.objects.get(pk=data['id']).status, SearchHistory.FAILED)
+
+
+class CoalescedSearchTests(TestCase):
+    def test_waiter_gets_its_own_history_row(self):
+        leader = SearchHistory.objects.create(query="ramen", latitude=35.69, longitude=139.69)
+        places = [{'name': "Ramen 1", 'address': "1 Street", 'distance_m': 100, 'is_best': True}]
+        shared = ({'id': leader.id, 'query': "ramen", 'places': places}, 200)
+
+        # The leader ran the search; this request only waited for its result.
+        with mock.patch('search_app.views.search_flight.do', lambda key, fn: shared):
+            response = self.client.get(reverse('place-search'), {'q': "Ramen", 'lat': 35.6901, 'lng': 139.6902})
+
+        self.assertEqual(response.status_code, 200)
+        waiter = SearchHistory.objects.exclude(pk=leader.pk).get()
+        self.assertEqual(response.data['id'], waiter.id)
+        self.assertEqual((waiter.query, waiter.latitude, waiter.longitude), ("Ramen", 35.6901, 139.6902))
+        self.assertEqual(list(waiter.places.values_list('name', 'is_best')), [("Ramen 1", True)])
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight('test')
+
+    def run_concurrently(self, fn, callers):
+        """Start `callers` calls of `fn` on one key while the first is in flight; returns their outcomes."""
+        release = threading.Event()
+        outcomes = []
+
+        def blocked():
+            release.wait(2)
+            return fn()
+
+        def call():
+            try:
+                outcomes.append(self.flight.do('key', blocked))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        threads[0].start()
+        wait_until(lambda: self.flight.stats()['in_flight'] == 1)
+        for thread in threads[1:]:
+            thread.start()
+        wait_until(lambda: self.flight.stats()['coalesced'] == callers - 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        fn = mock.Mock(return_value="result")
+        self.assertEqual(self.run_concurrently(fn, 4), ["result"] * 4)
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(self.flight.stats(), {'leaders': 1, 'coalesced': 3, 'coalesced_remote': 0, 'in_flight': 0})
+
+    def test_error_reaches_every_waiter_and_is_not_kept(self):
+        error = RuntimeError("upstream down")
+        self.assertEqual(self.run_concurrently(mock.Mock(side_effect=error), 3), [error] * 3)
+        self.assertEqual(self.flight.do('key', lambda: "retried"), "retried")
+
+    @override_settings(SINGLE_FLIGHT={**settings.SINGLE_FLIGHT, 'SHARED': True, 'POLL_INTERVAL': 0.01})
+    def test_waits_for_the_result_another_process_publishes(self):
+        cache.add(hashed_key("singleflight:test:lock:", 'key'), 1)
+        threading.Timer(0.05, cache.set, [hashed_key("singleflight:test:result:", 'key'), "remote"]).start()
+        fn = mock.Mock(return_value="local")
+        self.assertEqual(self.flight.do('key', fn), "remote")
+        fn.assert_not_called()
+        self.assertEqual(self.flight.stats()['coalesced_remote'], 1)
+
+    @override_settings(SINGLE_FLIGHT={**settings.SINGLE_FLIGHT, 'SHARED': True, 'POLL_INTERVAL': 0.01})
+    def test_runs_itself_when_the_other_process_gives_up(self):
+        lock_key = hashed_key("singleflight:test:lock:", 'key')
+        cache.add(lock_key, 1)
+        threading.Timer(0.05, cache.delete, [lock_key]).start()
+        self.assertEqual(self.flight.do('key', lambda: "local"), "local")
+        self.assertEqual(self.flight.stats()['coalesced_remote'], 0)
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    def test_replays_fixtures_and_reports_percentiles(self):
+        out = StringIO()
+        # One worker: the in-memory test database locks tables across threads.
+        call_command(
+            'loadtest', requests=6, concurrency=1, upstream_latency=0, gemini_latency=0,
+            json_path='-', stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['status_codes'], {'200': 6})
+        self.assertLessEqual(report['latency_ms']['p50'], report['latency_ms']['p99'])
+        self.assertGreater(report['gemini_calls'], 0)
+        self.assertIn('enrich', report['stage_ms'])
+        # Searches written during the run are removed afterwards.
+        self.assertFalse(SearchHistory.objects.exists())
+
+    def test_removes_only_its_own_searches(self):
+        run = LoadTestCommand._run
+        outside = []
+
+        def run_alongside_traffic(command, *args):
+            result = run(command, *args)
+            outside.append(SearchHistory.objects.create(query="ramen", latitude=35.69, longitude=139.69).id)
+            return result
+
+        with mock.patch.object(LoadTestCommand, '_run', run_alongside_traffic):
+            call_command(
+                'loadtest', requests=3, concurrency=1, upstream_latency=0, gemini_latency=0,
+                json_path='-', stdout=StringIO(),
+            )
+        self.assertEqual(list(SearchHistory.objects.values_list('id', flat=True)), outside)
+
+
+class StreamSearchTests(TransactionTestCase):
+    def setUp(self):
+        fixtures = replay.load_fixtures()
+        self.pipeline = SearchPipeline(
+            places_adapter=replay.ReplayPlacesAdapter(fixtures),
+            distance_adapter=replay.ReplayDistanceMatrixAdapter(fixtures),
+            model=replay.ReplayModel(fixtures),
+        )
+        self.places, _ = self.pipeline.find("ramen", 35.6895, 139.6917, 5, 5000)
+
+    def stream(self):
+        chunks = stream_search(self.pipeline, "ramen", 35.6895, 139.6917, self.places, NDJSON)
+        return [json.loads(chunk) for chunk in chunks]
+
+    def astream(self):
+        async def collect():
+            chunks = astream_search(self.pipeline, "ramen", 35.6895, 139.6917, self.places, NDJSON)
+            return [json.loads(chunk) async for chunk in chunks]
+        return async_to_sync(collect)()
+
+    def assert_event_order(self, events):
+        names = [event['event'] for event in events]
+        self.assertEqual(names[0], 'places')
+        self.assertEqual(names[-2:], ['best', 'done'])
+        patches = names[1:-2]
+        self.assertEqual(patches.count('distance'), len(self.places))
+        self.assertEqual(patches.count('enrichment'), len(self.places))
+        # Distances arrive together, however enrichment interleaves with them.
+        first = patches.index('distance')
+        self.assertEqual(patches[first:first + len(self.places)], ['distance'] * len(self.places))
+
+        best = events[-2]['data']['index']
+        search_record = SearchHistory.objects.get(pk=events[-1]['data']['id'])
+        self.assertEqual(search_record.places.get(is_best=True).name, self.places[best]['name'])
+
+    def test_sync_stream_event_order(self):
+        self.assert_event_order(self.stream())
+
+    def test_async_stream_event_order(self):
+        self.assert_event_order(self.astream())
+
+    def test_enrichment_failure_ends_the_stream_with_an_error(self):
+        def failing(places, query):
+            yield 'place', 0
+            raise RuntimeError("model down")
+
+        enricher = mock.Mock(iter_enrich=failing)
+        for collect in (self.stream, self.astream):
+            with mock.patch.object(self.pipeline, 'enricher', return_value=enricher):
+                with self.assertLogs('search_app.streaming', 'ERROR'):
+                    events = collect()
+            self.assertEqual(events[-1], {'event': 'error', 'data': {'error': "Search failed: model down"}})
+            self.assertNotIn('done', [event['event'] for event in events])
+        self.assertFalse(SearchHistory.objects.exists())
+
+
+class PruneSearchHistoryTests(TestCase):
+    def search(self, query, days_ago):
+        search = SearchHistory.objects.create(query=query, latitude=35.69, longitude=139.69)
+        SearchHistory.objects.filter(pk=search.pk).update(search_time=self.now - timedelta(days=days_ago))
+        RecommendedPlace.objects.create(search=search, name=f"{query} place", address="1 Street")
+        return search
+
+    def test_rolls_up_by_canonical_query_and_deletes_only_old_searches(self):
+        self.now = timezone.now().replace(hour=12)
+        for query in ("Ramen", "ramen near me", "RAMEN!", "sushi"):
+            self.search(query, days_ago=100)
+        self.search("ramen", days_ago=101)
+        kept = [self.search("ramen", days_ago=10), self.search("udon", days_ago=89)]
+        old_day = timezone.localdate(self.now - timedelta(days=100))
+        SearchRollup.objects.create(day=old_day, query="ramen", searches=2)
+
+        call_command('prune_search_history', days=90, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(
+            set(SearchRollup.objects.values_list('day', 'query', 'searches')),
+            {
+                (old_day, "ramen", 5),
+                (old_day, "sushi", 1),
+                (old_day - timedelta(days=1), "ramen", 1),
+            },
+        )
+        self.assertEqual(set(SearchHistory.objects.all()), set(kept))
+        self.assertEqual(set(RecommendedPlace.objects.values_list('search', flat=True)), {s.pk for s in kept})
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SlidingWindowTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock(1_000_000 * 60)  # on a window boundary
+        self.window = SlidingWindow('test', 'client', limit=100, window=60, clock=self.clock)
+
+    def drive(self, rate, seconds, cost=1):
+        """Send `rate` requests a second for `seconds`; returns the times of those allowed."""
+        allowed = []
+        for _ in range(int(rate * seconds)):
+            if self.window.hit(cost)[0]:
+                allowed.append(self.clock.now)
+            self.clock.now += 1 / rate
+        return allowed
+
+    def test_usage_weights_previous_window_by_overlap(self):
+        self.assertEqual(sliding_window_usage(100, 10, 0, 60), 110)
+        self.assertEqual(sliding_window_usage(100, 10, 45, 60), 35)
+        self.assertEqual(sliding_window_usage(100, 10, 60, 60), 10)
+
+    def test_sustained_high_rate_is_held_to_the_limit(self):
+        # 50 requests a second, 30 times the limit, for ten windows.
+        allowed = self.drive(rate=50, seconds=600)
+        self.assertLessEqual(len(allowed), 10 * 100)
+        self.assertGreaterEqual(len(allowed), 10 * 100 * 0.95)
+        # No trailing 60 seconds lets through noticeably more than the limit.
+        start = 0
+        for end, at in enumerate(allowed):
+            while allowed[start] <= at - 60:
+                start += 1
+            self.assertLessEqual(end - start + 1, 101)
+
+    def test_burst_across_window_boundary_is_not_doubled(self):
+        self.clock.now += 59
+        self.assertEqual(len(self.drive(rate=1000, seconds=0.5)), 100)
+        # A fixed window would reset here and let another 100 through.
+        self.clock.now += 0.5
+        self.assertEqual(len(self.drive(rate=1000, seconds=0.5)), 0)
+
+    def test_costs_are_weighted(self):
+        self.assertEqual(len(self.drive(rate=100, seconds=1, cost=30)), 3)
+        # The refused requests weren't counted: 10 units are still free.
+        self.assertTrue(self.window.hit(10)[0])
+        self.assertFalse(self.window.hit(1)[0])
+
+    def test_wait_is_when_the_request_would_fit(self):
+        self.drive(rate=1000, seconds=1)
+        self.clock.now += 30
+        allowed, wait = self.window.hit(5)
+        self.assertFalse(allowed)
+        self.clock.now += wait - 0.01
+        self.assertFalse(self.window.hit(5)[0])
+        self.clock.now += 0.02
+        self.assertTrue(self.window.hit(5)[0])
+
+    def test_cost_over_the_limit_never_fits(self):
+        allowed, wait = self.window.hit(101)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 60)
+
+
+class CountingDistanceMatrixAdapter(GoogleDistanceMatrixAdapter):
+    """GoogleDistanceMatrixAdapter, with its cache, answering from fixtures and recording each request."""
+
+    def __init__(self, fixtures):
+        super().__init__()
+        self.replay = replay.ReplayDistanceMatrixAdapter(fixtures)
+        self.requests = []
+
+    def _request(self, origins, destinations, mode, units):
+        self.requests.append((origins.split("|"), destinations))
+        return self.replay.get_distances(origins, destinations, mode, units)
+
+
+class RunBatchTests(TestCase):
+    # Three users a few hundred metres apart, in different geohash cells.
+    POINTS = [(35.6895, 139.6917), (35.6920, 139.6950), (35.6870, 139.6880)]
+
+    def setUp(self):
+        get_cache('distance').clear()
+        fixtures = replay.load_fixtures()
+        self.distances = CountingDistanceMatrixAdapter(fixtures)
+        self.pipeline = SearchPipeline(
+            places_adapter=replay.ReplayPlacesAdapter(fixtures),
+            distance_adapter=self.distances,
+            model=replay.ReplayModel(fixtures),
+        )
+
+    def test_same_query_shares_distance_requests_across_points(self):
+        items = [("ramen", lat, lng) for lat, lng in self.POINTS] + [("Ramen near me", *self.POINTS[0])]
+        response = self.pipeline.run_batch(items)
+
+        self.assertEqual(len(self.distances.requests), 1)
+        origins, destinations = self.distances.requests[0]
+        self.assertEqual(len(origins), 3)
+        self.assertLessEqual(len(origins) * len(destinations), GoogleDistanceMatrixAdapter.MAX_ELEMENTS)
+        for data in response:
+            self.assertTrue(data['places'])
+            self.assertTrue(all(place['distance_m'] is not None for place in data['places']))
+
+    def test_repeated_batch_is_served_from_cache(self):
+        items = [("ramen", lat, lng) for lat, lng in self.POINTS]
+        self.pipeline.run_batch(items)
+        self.distances.requests.clear()
+        self.pipeline.run_batch(items)
+        self.assertEqual(self.distances.requests, [])
+
+    def test_destination_chunks_only_send_origins_missing_there(self):
+        destinations = [f"35.69,139.{7000 + i}" for i in range(30)]
+        cached, uncached = "35.6895,139.6917", "35.6920,139.6950"
+        # Cache the first origin against the first chunk of destinations only.
+        self.distances.get_distance_matrix([cached], destinations[:25])
+        self.distances.requests.clear()
+
+        rows = self.distances.get_distance_matrix([cached, uncached], destinations)
+        self.assertEqual(
+            [(origins, len(chunk)) for origins, chunk in self.distances.requests],
+            [([uncached], 25), ([cached, uncached], 5)],
+        )
+        self.assertTrue(all(elem is not None for row in rows for elem in row))
+
+
+class SearchCatalogTests(TestCase):
+    LAT, LNG = 35.6895, 139.6917
+
+    def setUp(self):
+        # Ramen places ever further north of the user, all within 2km, and a cafe.
+        results = [
+            {
+                'place_id': f"ramen-{i}", 'name': f"Ramen {i}", 'types': ['restaurant'],
+                'geometry': {'location': {'lat': self.LAT + i * 0.001, 'lng': self.LNG}},
+                'user_ratings_total': i,
+            }
+            for i in range(10)
+        ]
+        record_places(results, "ramen")
+        record_places([{
+            'place_id': "cafe", 'name': "Cafe", 'types': ['cafe'],
+            'geometry': {'location': {'lat': self.LAT, 'lng': self.LNG}},
+        }], "coffee")
+
+    def test_matches_text_in_one_query(self):
+        with self.assertNumQueries(1):
+            results = search_catalog("ramen", self.LAT, self.LNG, 2000)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(search_catalog("coffee", self.LAT, self.LNG, 2000)[0]['place_id'], "cafe")
+        self.assertEqual(search_catalog("sushi", self.LAT, self.LNG, 2000), [])
+
+    def test_candidate_limit_keeps_the_nearest(self):
+        with override_settings(LOCAL_CATALOG={**settings.LOCAL_CATALOG, 'MAX_CANDIDATES': 3}):
+            results = search_catalog("ramen", self.LAT, self.LNG, 2000)
+        self.assertEqual({r['place_id'] for r in results}, {"ramen-0", "ramen-1", "ramen-2"})
+
+    def test_excludes_places_outside_the_radius(self):
+        results = search_catalog("ramen", self.LAT, self.LNG, 350)
+        self.assertEqual({r['place_id'] for r in results}, {"ramen-0", "ramen-1", "ramen-2", "ramen-3"})
+
+
+class UpstreamLimiterTests(SimpleTestCase):
+    def limiter(self, rate, burst, wait=0):
+        return UpstreamLimiter('test', {'RATE': rate, 'BURST': burst, 'WAIT': wait, 'BUDGET_PER_MINUTE': 0})
+
+    def test_cost_above_burst_is_taken_a_burst_at_a_time(self):
+        limiter = self.limiter(rate=1000, burst=5, wait=1)
+        self.assertTrue(limiter.acquire(12))
+        self.assertEqual(limiter.stats(), {'spent': 12, 'throttled': 0})
+
+    def test_refused_chunks_are_refunded(self):
+        limiter = self.limiter(rate=0.001, burst=5)
+        self.assertFalse(limiter.acquire(8))
+        self.assertTrue(limiter.acquire(5))
+
+    def test_degraded_enrichment_counts_throttled_prompts_once(self):
+        enricher = PlaceEnricher(model=object(), use_store=False, score=True)
+        enricher.limiter = self.limiter(rate=0.001, burst=6)
+        # 5 places want 15 prompts; only the 5 scores fit.
+        self.assertEqual(enricher._affordable_fields(5, 5), {'score'})
+        self.assertEqual(enricher.limiter.stats(), {'spent': 5, 'throttled': 10})
+
+
+class FakeHTTPResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class UpstreamClientTests(SimpleTestCase):
+    def client_with(self, session_get, **config):
+        client = UpstreamClient({
+            **settings.UPSTREAM_HTTP, 'MAX_RETRIES': 0, 'CIRCUIT_FAILURE_THRESHOLD': 2, **config,
+        })
+        client.session.get = mock.Mock(side_effect=session_get)
+        return client
+
+    def test_places_outage_does_not_open_distance_matrix_circuit(self):
+        def session_get(url, **kwargs):
+            if url == settings.GOOGLE_PLACES_URL:
+                raise requests.exceptions.ConnectionError("places down")
+            return FakeHTTPResponse({'status': 'OK'})
+
+        client = self.client_with(session_get)
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.get(settings.GOOGLE_PLACES_URL)
+        with self.assertRaises(CircuitOpenError):
+            client.get(settings.GOOGLE_PLACES_URL)
+        self.assertEqual(client.get(settings.GOOGLE_DISTANCE_MATRIX_URL).json(), {'status': 'OK'})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+        patcher = mock.patch('search_app.http_client.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_trial_through(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_failure()  # the trial failed: stay open
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+
+class RetryBudgetTests(SimpleTestCase):
+    def test_retries_stop_when_the_budget_is_spent(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_client_gives_up_when_the_budget_is_spent(self):
+        client = UpstreamClient({
+            **settings.UPSTREAM_HTTP, 'MAX_RETRIES': 5, 'BACKOFF': 0, 'RETRY_BUDGET_RATIO': 0, 'RETRY_BUDGET_MAX': 2,
+        })
+        client.session.get = mock.Mock(return_value=mock.Mock(status_code=503))
+        self.assertEqual(client.get(settings.GOOGLE_PLACES_URL).status_code, 503)
+        self.assertEqual(client.session.get.call_count, 3)
+        client.get(settings.GOOGLE_PLACES_URL)
+        self.assertEqual(client.session.get.call_count, 4)
+
+
+class PlacesCatalogRecordingTests(TestCase):
+    def setUp(self):
+        get_cache('places').clear()
+        fixtures = replay.load_fixtures()
+        http = mock.Mock()
+        http.get.return_value = FakeHTTPResponse(fixtures['places']['ramen'])
+        patcher = mock.patch('search_app.adapters.get_http_client', return_value=http)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.http = http
+
+    def test_cache_hits_do_not_write_the_catalog(self):
+        pipeline = SearchPipeline(places_adapter=GooglePlacesAdapter(on_fetch=record_places))
+        pipeline.places("ramen", 35.6895, 139.6917, 5000)
+        self.assertTrue(CatalogPlace.objects.exists())
+
+        with self.assertNumQueries(0):
+            pipeline.places("ramen", 35.6895, 139.6917, 5000)
+        self.assertEqual(self.http.get.call_count, 1)
+
+
+class DjangoCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_keys_are_hashed_and_safe_for_memcached(self):
+        places = DjangoCache(60, prefix='places:')
+        key = "ramen shop tokyo " * 20 + "|xn76db|5000"
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')  # CacheKeyWarning
+            places.set(key, ['result'])
+            self.assertEqual(places.get(key), ['result'])
+        self.assertIsNone(places.get("sushi|xn76db|5000"))
+
+    def test_clear_leaves_the_shared_alias_alone(self):
+        cache.set('ratelimit:gemini:1', 5)
+        with self.assertRaises(NotImplementedError):
+            DjangoCache(60, prefix='places:').clear()
+        self.assertEqual(cache.get('ratelimit:gemini:1'), 5)
+
+
+class FakeModel:
+    """Answers the batch prompt with `batch_reply` and each per-place prompt after `delay`."""
+
+    def __init__(self, batch_reply="[]", delay=0):
+        self.batch_reply = batch_reply
+        self.delay = delay
+        self.prompts = []
+
+    def generate_content(self, prompt, generation_config=None):
+        self.prompts.append(prompt)
+        if generation_config is not None:
+            text = self.batch_reply
+        else:
+            time.sleep(self.delay)
+            text = "Score: 0.9" if prompt.startswith("Give a score") else "generated"
+        return mock.Mock(text=text)
+
+
+class PlaceEnricherTests(SimpleTestCase):
+    def setUp(self):
+        self.places = [{'name': f"Place {idx}", 'address': f"{idx} Main St"} for idx in range(3)]
+        executor = ThreadPoolExecutor(max_workers=9)
+        self.addCleanup(executor.shutdown, wait=False, cancel_futures=True)
+        self.executor = executor
+
+    def enricher(self, model, mode='batched', timeout=5):
+        enricher = PlaceEnricher(
+            model=model, executor=self.executor, timeout=timeout, mode=mode, use_store=False, score=True
+        )
+        enricher.limiter = UpstreamLimiter('test', {'RATE': 1000, 'BURST': 1000, 'WAIT': 0, 'BUDGET_PER_MINUTE': 0})
+        return enricher
+
+    def test_invalid_batch_items_fall_back_to_per_place_prompts(self):
+        model = FakeModel(json.dumps([
+            {'index': 0, 'description': "batched", 'review_summary': "batched", 'score': 0.5},
+            {'index': 1, 'description': "batched", 'review_summary': "batched", 'score': 7},
+        ]))
+        best = self.enricher(model).enrich(self.places, "ramen")
+        self.assertEqual(self.places[0]['description'], "batched")
+        self.assertEqual([p['description'] for p in self.places[1:]], ["generated", "generated"])
+        # 1 batch prompt, then 3 prompts each for the two places it didn't cover.
+        self.assertEqual(len(model.prompts), 7)
+        self.assertEqual(best, 1)
+
+    def test_malformed_batch_reply_sends_every_place_per_place(self):
+        model = FakeModel("Sure! Here are your places:")
+        self.enricher(model).enrich(self.places, "ramen")
+        self.assertEqual([p['review_summary'] for p in self.places], ["generated"] * 3)
+        self.assertEqual(len(model.prompts), 10)
+
+    def test_prompts_still_running_at_the_deadline_fail_the_place(self):
+        start = time.monotonic()
+        scores = []
+        with self.assertLogs('search_app.enrichment', 'WARNING'):
+            best = self.enricher(FakeModel(delay=1), mode='individual', timeout=0.2).enrich(self.places, "ramen", scores)
+        self.assertLess(time.monotonic() - start, 0.8)
+        for place in self.places:
+            self.assertEqual(place['description'], "Failed to generate description: timed out")
+        self.assertEqual(scores, [-1, -1, -1])
+        self.assertEqual(best, 0)
+
+
+class ParseBatchResponseTests(SimpleTestCase):
+    ITEM = {'index': 0, 'description': "d", 'review_summary': "r", 'score': 0.5}
+
+    def test_malformed_json_yields_nothing(self):
+        for text in ("", "not json", '[{"index": 0,', '{"index": 0}', "null"):
+            self.assertEqual(parse_batch_response(text, 1), {}, text)
+
+    def test_strips_a_json_code_fence(self):
+        text = "```json\n" + json.dumps([self.ITEM]) + "\n```"
+        self.assertEqual(parse_batch_response(text, 1), {0: self.ITEM})
+
+    def test_drops_items_outside_the_schema(self):
+        items = [
+            self.ITEM,
+            {**self.ITEM, 'index': 1, 'score': 1.5},
+            {**self.ITEM, 'index': True},
+            {**self.ITEM, 'index': 2, 'description': None},
+            {**self.ITEM, 'index': 9},
+            "place 3",
+        ]
+        self.assertEqual(parse_batch_response(json.dumps(items), 4), {0: self.ITEM})
+
+
+class ModelRegistryTests(SimpleTestCase):
+    CONFIG = {'DEFAULT': "large", 'SMALL': "small", 'SMALL_TASKS': ['review_summary'], 'TASKS': {}}
+
+    def test_warm_connects_each_model_once_only_when_asked(self):
+        clients = {}
+        registry = ModelRegistry(self.CONFIG, factory=lambda name: clients.setdefault(name, mock.Mock()))
+        registry.warm()
+        self.assertEqual(set(clients), {"large", "small"})
+        self.assertFalse(any(client.count_tokens.called for client in clients.values()))
+
+        registry.warm(connect=True)
+        for client in clients.values():
+            client.count_tokens.assert_called_once()
+
+
+class SubmitEnrichmentTests(SimpleTestCase):
+    def test_runs_off_the_gemini_pool_in_the_callers_context(self):
+        request = contextvars.ContextVar('request')
+        request.set("search 1")
+
+        def job():
+            return request.get(), threading.current_thread().name
+
+        value, thread = submit_enrichment(job).result()
+        self.assertEqual(value, "search 1")
+        self.assertTrue(thread.startswith('enrichment-coordinator'))
+
+
+def weights(**weights):
+    return override_settings(SEARCH_RANKING={
+        **settings.SEARCH_RANKING, 'WEIGHTS': {'rating': 0, 'popularity': 0, 'distance': 0, 'text': 0, **weights},
+    })
+
+
+class RankResultsTests(SimpleTestCase):
+    LAT, LNG = 35.6895, 139.6917
+
+    def place(self, name, north_m=0, rating=None, reviews=None, types=()):
+        return {
+            'name': name,
+            'geometry': {'location': {'lat': self.LAT + north_m / 111_320, 'lng': self.LNG}},
+            'rating': rating,
+            'user_ratings_total': reviews,
+            'types': list(types),
+        }
+
+    def names(self, results, query="ramen", limit=10):
+        return [place['name'] for place in rank_results(results, query, self.LAT, self.LNG, 1000, limit)]
+
+    @weights(rating=1)
+    def test_sparse_perfect_rating_loses_to_many_good_ones(self):
+        results = [self.place("sparse", rating=5.0, reviews=3), self.place("proven", rating=4.6, reviews=3000)]
+        self.assertEqual(self.names(results), ["proven", "sparse"])
+
+    @weights(distance=1)
+    def test_nearer_first_and_beyond_the_radius_last(self):
+        results = [
+            self.place("far", north_m=5000),
+            self.place("unlocated") | {'geometry': {}},
+            self.place("mid", north_m=600),
+            self.place("near", north_m=100),
+        ]
+        # Beyond the radius and unknown locations tie at zero, in Google's order.
+        self.assertEqual(self.names(results), ["near", "mid", "far", "unlocated"])
+
+    @weights(text=1)
+    def test_query_terms_match_name_and_types(self):
+        results = [
+            self.place("Blue Cafe"),
+            self.place("Menya", types=["ramen_restaurant"]),
+            self.place("Spicy Ramen House"),
+        ]
+        self.assertEqual(self.names(results, query="spicy ramen"), ["Spicy Ramen House", "Menya", "Blue Cafe"])
+
+    def test_ties_keep_googles_order_and_limit_applies(self):
+        results = [self.place(f"place {idx}", rating=4.0, reviews=100) for idx in range(5)]
+        self.assertEqual(self.names(results, limit=3), ["place 0", "place 1", "place 2"])
+
+
+class CanonicalQueryTests(SimpleTestCase):
+    def test_folds_case_whitespace_and_punctuation(self):
+        self.assertEqual(canonical_query("  Ramen!!  "), "ramen")
+        self.assertEqual(canonical_query("Ramen,   Tokyo"), "ramen tokyo")
+        self.assertEqual(canonical_query("fish & chips"), "fish & chips")
+
+    def test_drops_location_phrases(self):
+        self.assertEqual(canonical_query("ramen near me"), "ramen")
+        self.assertEqual(canonical_query("Coffee nearby"), "coffee")
+        self.assertEqual(canonical_query("close to me sushi"), "sushi")
+
+    def test_keeps_words_that_change_the_search(self):
+        for query in ("department store", "gift shop", "pet store", "book store", "hot spots"):
+            self.assertEqual(canonical_query(query), query)
+
+    def test_only_stop_words_falls_back_to_folded_query(self):
+        self.assertEqual(canonical_query("Near Me"), "near me")
+
+    @override_settings(SEARCH_QUERY_SYNONYMS={"ramen shop": "ramen"})
+    def test_applies_synonyms_to_whole_query(self):
+        self.assertEqual(canonical_query("Ramen Shop near me"), "ramen")
+        self.assertEqual(canonical_query("ramen shop tokyo"), "ramen shop tokyo")
@@ -0,0 +1,157 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches as django_caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'120/min' -> (120, 60). The period is read from its first letter, as DRF does."""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def sliding_window_usage(previous, current, elapsed, window):
+    """
+    Estimated usage over the trailing `window` seconds, `elapsed` seconds
+    into the current fixed window: all of the current window's count plus
+    the share of the previous window's that still overlaps, assuming its
+    requests were spread evenly.
+    """
+    return previous * (window - elapsed) / window + current
+
+
+def sliding_window_wait(previous, current, elapsed, window, cost, limit):
+    """Seconds until `cost` more fits under `limit`; 0 if it fits now, None if it never will."""
+    if cost > limit:
+        return None
+    room = limit - cost
+    if sliding_window_usage(previous, current, elapsed, window) <= room:
+        return 0.0
+    if current <= room and previous:
+        # The previous window's share decays enough before this one ends.
+        return (sliding_window_usage(previous, current, elapsed, window) - room) * window / previous
+    # Wait for this window to become the previous one and decay in turn.
+    return (window - elapsed) + window * max(0.0, 1 - room / current)
+
+
+class SlidingWindow:
+    """
+    Cost-weighted sliding-window counter for one client and scope, kept in
+    a Django cache alias as one counter per fixed window.
+    """
+
+    def __init__(self, scope, ident, limit, window, alias='default', clock=time.time):
+        self.scope = scope
+        self.ident = ident
+        self.limit = limit
+        self.window = window
+        self.alias = alias
+        self.clock = clock
+
+    def _key(self, index):
+        return f"throttle:{self.scope}:{self.ident}:{index}"
+
+    def hit(self, cost=1):
+        """Count `cost` if it fits; returns (allowed, seconds to wait if not)."""
+        cache = django_caches[self.alias]
+        now = self.clock()
+        index = int(now // self.window)
+        elapsed = now - index * self.window
+        current_key = self._key(index)
+
+        cache.add(current_key, 0, timeout=self.window * 2)
+        try:
+            current = cache.incr(current_key, cost)
+        except ValueError:  # evicted between add and incr
+            cache.add(current_key, cost, timeout=self.window * 2)
+            current = cost
+        previous = cache.get(self._key(index - 1), 0)
+
+        if sliding_window_usage(previous, current, elapsed, self.window) <= self.limit:
+            return True, 0.0
+        cache.decr(current_key, cost)
+        wait = sliding_window_wait(previous, current - cost, elapsed, self.window, cost, self.limit)
+        return False, self.window if wait is None else wait
+
+
+def search_cost(cached=False, places=None):
+    """Throttle cost of a search: cheap when served from cache, more per enriched place."""
+    costs = settings.SEARCH_THROTTLE['COSTS']
+    if cached:
+        return costs['cached']
+    if places is None:
+        places = settings.SEARCH_RESULTS['DEFAULT_LIMIT']
+    return costs['search'] + costs['per_place'] * places
+
+
+def client_ident(request, user=None):
+    """('user', pk) for an authenticated user, else ('ip', address)."""
+    if user is not None and user.is_authenticated:
+        return 'user', str(user.pk)
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded and settings.SEARCH_THROTTLE['TRUST_X_FORWARDED_FOR']:
+        return 'ip', forwarded.split(',')[0].strip()
+    return 'ip', request.META.get('REMOTE_ADDR', '')
+
+
+def throttle_wait(request, user, cost):
+    """
+    Charge `cost` to the client's search scope: 'search_user' for
+    authenticated users, 'search_ip' for everyone else. Returns 0 if the
+    request may proceed, else the seconds to wait.
+    """
+    kind, ident = client_ident(request, user)
+    scope = f'search_{kind}'
+    rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+    if not rate:
+        return 0
+    limit, window = parse_rate(rate)
+    allowed, wait = SlidingWindow(scope, ident, limit, window, settings.SEARCH_THROTTLE['ALIAS']).hit(cost)
+    if allowed:
+        return 0
+    metrics.inc('search_throttled_total', scope=scope)
+    return wait
+
+
+def response_cache_key(request, user, key):
+    """Key of the client's cached response to the search with `search_key` `key`."""
+    kind, ident = client_ident(request, user)
+    return f"{kind}:{ident}:{key}"
+
+
+def token_user(request):
+    """The user of a DRF token in a plain Django request, or None."""
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return authenticated[0] if authenticated else None
+
+
+def retry_after(wait):
+    return str(max(1, math.ceil(wait)))
+
+
+class SearchRateThrottle(BaseThrottle):
+    """
+    DRF throttle charging each search its cost, as reported by the view's
+    `get_throttle_cost(request)`, against the client's sliding window.
+    """
+
+    def allow_request(self, request, view):
+        get_cost = getattr(view, 'get_throttle_cost', None)
+        cost = get_cost(request) if get_cost else search_cost()
+        self._wait = throttle_wait(request, request.user, cost)
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
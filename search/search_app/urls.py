@@ -1,7 +1,17 @@
 # places_api/urls.py
 from django.urls import path
-from .views import PlaceSearchView
+from .views import (
+    PlaceSearchView, SearchBatchView, SearchDetailView, SearchHistoryListView, async_place_search, async_place_search_stream,
+    cache_stats_view, place_search_stream,
+)
 
 urlpatterns = [
     path('search/', PlaceSearchView.as_view(), name='place-search'),
+    path('search/batch/', SearchBatchView.as_view(), name='place-search-batch'),
+    path('search/history/', SearchHistoryListView.as_view(), name='search-history'),
+    path('search/<int:pk>/', SearchDetailView.as_view(), name='search-detail'),
+    path('search/stream/', place_search_stream, name='place-search-stream'),
+    path('search/async/', async_place_search, name='place-search-async'),
+    path('search/async/stream/', async_place_search_stream, name='place-search-async-stream'),
+    path('cache/stats/', cache_stats_view, name='cache-stats'),
 ]
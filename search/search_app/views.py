@@ -1,217 +1,360 @@
 from django.conf import settings
-from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 
-import requests
-import google.generativeai as genai
-import re
+import math
+import time
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 
 from .models import SearchHistory, RecommendedPlace
-from django.contrib.auth.models import User
 from rest_framework import generics
+from rest_framework.pagination import CursorPagination
+from django.db.models import Prefetch
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from .serializers import SearchHistorySerializer
-from .adapters import GooglePlacesAdapter, GoogleDistanceMatrixAdapter
+from .pipeline import get_pipeline, resolve_fanout, search_key
+from .cache import cache_stats, get_cache
+from .ratelimit import limiter_stats
+from .coalesce import search_flight
+from . import metrics
+from .query import canonical_query
+from .streaming import NDJSON, SSE, astream_search, stream_search
+from .throttling import (
+    SearchRateThrottle, response_cache_key, retry_after, search_cost, throttle_wait, token_user,
+)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats_view(request):
+    """Hit/miss counters for this worker's upstream caches and search coalescing, and upstream spend."""
+    stats = cache_stats()
+    stats['single_flight'] = search_flight.stats()
+    stats['rate_limits'] = limiter_stats()
+    return Response(stats, status=status.HTTP_200_OK)
+
+
+@require_GET
+def metrics_view(request):
+    """This worker's metrics in the Prometheus text format, for scraping."""
+    allowed = settings.SEARCH_METRICS['ALLOWED_IPS']
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    body = metrics.render(cache_stats(), search_flight.stats())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class InvalidSearch(ValueError):
+    """Invalid search parameters; the message is the 400 response's error."""
+
+
+def parse_search(params, pipeline):
+    """
+    (query, user_lat, user_lng, limit, radius) from a search request's
+    parameters, shared by every search view. Raises InvalidSearch.
+    """
+    query = params.get('q')
+    if not query:
+        raise InvalidSearch("No search query provided.")
+    try:
+        # TODO: Use IP geolocation service to get actual location from IP.
+        # For now, use a default location as a fallback.
+        user_lat, user_lng = pipeline.geolocate(params.get('lat'), params.get('lng'))
+    except (TypeError, ValueError):
+        raise InvalidSearch("Invalid latitude/longitude format.")
+    try:
+        limit, radius = resolve_fanout(params.get('limit'), params.get('radius'))
+    except (TypeError, ValueError):
+        raise InvalidSearch("Invalid limit/radius.")
+    return query, user_lat, user_lng, limit, radius
 
-gemini_api_key = settings.GEMINI_API_KEY
 
 @permission_classes([AllowAny])
 class PlaceSearchView(APIView):
+    """
+    Search by query string (GET) or JSON/form body (POST), with the same
+    parameters: q, lat, lng, limit, radius and defer.
+    """
+    throttle_classes = [SearchRateThrottle]
+    # Set by get_throttle_cost for a valid search.
+    response_key = None
+    cached_response = None
+
+    def search_params(self, request):
+        return request.query_params if request.method == 'GET' else request.data
+
+    def get_throttle_cost(self, request):
+        """
+        A search this client repeats within the response cache's TTL is
+        answered from it at the 'cached' cost; any other is charged for
+        each place it may enrich.
+        """
+        try:
+            query, user_lat, user_lng, limit, radius = parse_search(self.search_params(request), get_pipeline())
+        except InvalidSearch:
+            return search_cost(cached=True)  # rejected before any upstream call
+        self.response_key = response_cache_key(
+            request, request.user, search_key(query, user_lat, user_lng, limit, radius)
+        )
+        self.cached_response = get_cache('responses').get(self.response_key)
+        return search_cost(cached=self.cached_response is not None, places=limit)
 
     def get(self, request, format=None):
-        query = request.query_params.get('q')
-        lat = request.query_params.get('lat')
-        lng = request.query_params.get('lng')
+        return self.search(request)
 
-        if not query:
-            return Response({"error": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST)
+    def post(self, request, format=None):
+        return self.search(request)
 
-        if lat and lng:
-            try:
-                user_lat = float(lat); user_lng = float(lng)
-            except ValueError:
-                return Response({"error": "Invalid latitude/longitude format."}, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            user_ip = request.META.get('REMOTE_ADDR')
-            user_lat = user_lng = None
-            # TODO: Use IP geolocation service to get actual location from IP.
-            # For now, use a default location as a fallback.
-            user_lat = 35.6895; user_lng = 139.6917  # Example: Tokyo coordinates
-
-        # Use Google Places Adapter
-        places_adapter = GooglePlacesAdapter()
+    def search(self, request):
+        params = self.search_params(request)
+        pipeline = get_pipeline()
         try:
-            results = places_adapter.search_places(query, f"{user_lat},{user_lng}")
-        except requests.exceptions.RequestException as e:
-            return Response({"error": f"Places API request failed: {e}"}, status=status.HTTP_502_BAD_GATEWAY)
-
-        if not results:
-            return Response({"message": "No places found for the given query."}, status=status.HTTP_200_OK)
-        top_results = results[:5]
-
-        processed_places = []
-        destinations = []
-        for place in top_results:
-            name = place.get('name')
-            address = place.get('formatted_address') or place.get('vicinity', '')
-            rating = place.get('rating')
-            user_ratings = place.get('user_ratings_total')
-            loc = place.get('geometry', {}).get('location', {})
-            place_lat = loc.get('lat'); place_lng = loc.get('lng')
-            if place_lat and place_lng:
-                destinations.append(f"{place_lat},{place_lng}")
-            processed_places.append({
-                "name": name,
-                "address": address,
-                "rating": rating,
-                "user_ratings_count": user_ratings,
-                "latitude": place_lat,
-                "longitude": place_lng,
-                "description": "",
-                "review_summary": "",
-                "distance_m": None,
-                "walking_time_min": None,
-                "is_best": False
-            })
-
-        # Use Google Distance Matrix Adapter
-        distance_matrix_adapter = GoogleDistanceMatrixAdapter()
-        if destinations:
-            try:
-                dm_data = distance_matrix_adapter.get_distances(f"{user_lat},{user_lng}", destinations)
-            except requests.exceptions.RequestException as e:
-                dm_data = {}
-
-            if dm_data.get('status') == 'OK':
-                elements = dm_data.get('rows', [{}])[0].get('elements', [])
-                for idx, elem in enumerate(elements):
-                    if idx < len(processed_places) and elem.get('status') == 'OK':
-                        dist_m = elem['distance']['value']
-                        dur_s = elem['duration']['value']
-                        processed_places[idx]['distance_m'] = dist_m
-                        processed_places[idx]['walking_time_min'] = int(dur_s // 60)
-
-        # Use Gemini AI for descriptions and best selection
-        genai.configure(api_key=gemini_api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-001')
-
-        best_index = 0
-        highest_score = -1
-        for idx, place in enumerate(processed_places):
-            # Generate a description using Gemini
-            prompt_description = f"Write a short description for {place['name']} at {place['address']} based on the search query {query}."
-            try:
-                response_description = model.generate_content(prompt_description)
-                place['description'] = response_description.text
-            except Exception as e:
-                place['description'] = f"Failed to generate description: {e}"
+            query, user_lat, user_lng, limit, radius = parse_search(params, pipeline)
+        except InvalidSearch as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Generate a review summary using Gemini
-            prompt_review = f"Summarize the reviews for {place['name']} at {place['address']}."
-            try:
-                response_review = model.generate_content(prompt_review)
-                place['review_summary'] = response_review.text
-            except Exception as e:
-                place['review_summary'] = f"Failed to generate review summary: {e}"
+        if self.cached_response is not None:
+            return Response(self.cached_response, status=status.HTTP_200_OK)
 
-            # Determine the "best" place using Gemini
-            prompt_best = f"Give a score between 0 and 1 for {place['name']} at {place['address']} based on the search query {query}."
-            try:
-                response_best = model.generate_content(prompt_best)
-                # Extract the score using regex
-                match = re.search(r"score(?: of)?:\s*([0-9.]+)", response_best.text, re.IGNORECASE)
-                if match:
-                    score = float(match.group(1))
-                else:
-                    score = -1  # Default score if extraction fails
-                if score > highest_score:
-                    highest_score = score
-                    best_index = idx
-            except Exception as e:
-                print(f"Failed to get best score: {e}")
-
-        # Mark the best place
-        if 0 <= best_index < len(processed_places):
-            processed_places[best_index]['is_best'] = True
-
-        # Save search and places to the database
-        search_record = SearchHistory.objects.create(
-            query=query, latitude=user_lat, longitude=user_lng, search_time=timezone.now()
-        )
-        place_objects = []
-        for place in processed_places:
-            place_obj = RecommendedPlace(
-                search=search_record,
-                name=place['name'],
-                address=place['address'],
-                rating=place.get('rating'),
-                user_ratings_count=place.get('user_ratings_count') or 0,
-                description=place.get('description', ''),
-                review_summary=place.get('review_summary', ''),
-                distance_m=place.get('distance_m'),
-                walking_time_min=place.get('walking_time_min'),
-                is_best=place.get('is_best', False)
-            )
-            place_objects.append(place_obj)
-        RecommendedPlace.objects.bulk_create(place_objects)
+        defer = str(params.get('defer', settings.SEARCH_DEFER_ENRICHMENT))
+        if defer.lower() in ('1', 'true', 'yes'):
+            # Respond with places and distances now; poll search-detail for the rest.
+            data, status_code = pipeline.run(query, user_lat, user_lng, defer=True, limit=limit, radius=radius)
+            return Response(data, status=status_code)
 
-        # Serialize the processed places
-        places_serializer = SearchHistorySerializer(search_record)
-        places_data = places_serializer.data
+        # Identical searches from the same area that arrive while one is
+        # running wait for it and share its result.
+        led = []
 
-        # Add the processed places to the response data
-        places_data['places'] = processed_places
+        def run():
+            led.append(True)
+            return pipeline.run(query, user_lat, user_lng, limit=limit, radius=radius)
 
-        # Return the serialized data
-        return Response(places_data, status=status.HTTP_200_OK)
-    
-    def post(self, request, format=None):
-        query = request.data.get('q')
-        lat = request.data.get('lat')
-        lng = request.data.get('lng')
+        data, status_code = search_flight.do(search_key(query, user_lat, user_lng, limit, radius), run)
+        if not led and status_code == status.HTTP_200_OK and 'id' in data:
+            # Only the leader's search was stored; store this one as well, so
+            # the history (and the cache warming mined from it) counts every
+            # search rather than one per coalesced group.
+            search_record = pipeline.persist(query, user_lat, user_lng, data['places'])
+            data = pipeline.serialize(search_record, data['places'])
+        if status_code == status.HTTP_200_OK and self.response_key:
+            get_cache('responses').set(self.response_key, data)
+        return Response(data, status=status_code)
+
+
+@permission_classes([AllowAny])
+class SearchBatchView(APIView):
+    """
+    Several searches in one request, e.g. one query from each point of a
+    route: {"items": [{"q": ..., "lat": ..., "lng": ...}, ...], "limit": ...,
+    "radius": ...}. Responds with one result per item, in order.
+    """
+    throttle_classes = [SearchRateThrottle]
+
+    def get_throttle_cost(self, request):
+        """Each item is charged as a search of its own."""
+        items = request.data.get('items')
+        if not isinstance(items, list) or not 0 < len(items) <= settings.SEARCH_BATCH_MAX_ITEMS:
+            return search_cost(cached=True)  # rejected before any upstream call
+        try:
+            limit, _ = resolve_fanout(request.data.get('limit'), request.data.get('radius'))
+        except (TypeError, ValueError):
+            return search_cost(cached=True)
+        return len(items) * search_cost(places=limit)
 
-        if not query:
-            return Response({"error": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST)
+    def post(self, request, format=None):
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({"error": "No search items provided."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.SEARCH_BATCH_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {settings.SEARCH_BATCH_MAX_ITEMS} items per batch."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        if lat and lng:
+        pipeline = get_pipeline()
+        searches = []
+        for idx, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get('q'):
+                return Response({"error": f"Item {idx}: no search query provided."}, status=status.HTTP_400_BAD_REQUEST)
             try:
-                user_lat = float(lat); user_lng = float(lng)
-            except ValueError:
-                return Response({"error": "Invalid latitude/longitude format."}, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            user_ip = request.META.get('REMOTE_ADDR')
-            user_lat = user_lng = None
-            # TODO: Use IP geolocation service to get actual location from IP.
-            # For now, use a default location as a fallback.
-            user_lat = 35.6895; user_lng = 139.6917  # Example: Tokyo coordinates
-
-        if not google_api_key:
-            return Response({"error": "Server Google API key not configured."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        places_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
-        params = {
-            'query': query,
-            'location': f"{user_lat},{user_lng}",
-            'radius': 5000,
-            'key': google_api_key
-        }
+                user_lat, user_lng = pipeline.geolocate(item.get('lat'), item.get('lng'))
+            except (TypeError, ValueError):
+                return Response(
+                    {"error": f"Item {idx}: invalid latitude/longitude format."}, status=status.HTTP_400_BAD_REQUEST
+                )
+            searches.append((item['q'], user_lat, user_lng))
+
         try:
-            resp = requests.get(places_url, params=params); data = resp.json()
-        except Exception as e:
-            return Response({"error": f"Places API request failed: {e}"}, status=status.HTTP_502_BAD_GATEWAY)
-
-        results = data.get('results', [])
-        if not results:
-            return Response({"message": "No places found for the given query."}, status=status.HTTP_200_OK)
-        top_results = results[:5]
-
-        processed_places = []
-        destinations = []
-        for place in top_results:
-            name = place.get('name')
-            address = place.get('formatted_address') or place.get('vicinity', '')
-            rating = place.get('rating')
-            user_ratings = place.get('user_ratings_total')
-            loc = place.get('geometry', {})
+            limit, radius = resolve_fanout(request.data.get('limit'), request.data.get('radius'))
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid limit/radius."}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = pipeline.run_batch(searches, limit, radius)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+@permission_classes([AllowAny])
+class SearchDetailView(APIView):
+    """
+    A stored search and its places. For a search still being enriched in
+    the background, `?wait=<seconds>` long-polls until it completes.
+    """
+
+    def get(self, request, pk, format=None):
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            wait = math.nan
+        if not math.isfinite(wait):  # nan would never reach the deadline
+            return Response({"error": "Invalid wait value."}, status=status.HTTP_400_BAD_REQUEST)
+        wait = min(max(wait, 0), settings.SEARCH_LONG_POLL_MAX)
+
+        deadline = time.monotonic() + wait
+        while True:
+            search_record = SearchHistory.objects.filter(pk=pk).first()
+            if search_record is None:
+                return Response({"error": "Search not found."}, status=status.HTTP_404_NOT_FOUND)
+            if search_record.status != SearchHistory.PENDING or time.monotonic() >= deadline:
+                break
+            time.sleep(settings.SEARCH_LONG_POLL_INTERVAL)
+
+        return Response(SearchHistorySerializer(search_record).data, status=status.HTTP_200_OK)
+
+
+class SearchHistoryCursorPagination(CursorPagination):
+    # Keyset pagination: each page is an indexed range scan, however deep.
+    ordering = ('-search_time', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchHistoryListView(generics.ListAPIView):
+    """Past searches, newest first, each with its places and best recommendation."""
+    serializer_class = SearchHistorySerializer
+    pagination_class = SearchHistoryCursorPagination
+
+    def get_queryset(self):
+        # Two prefetch queries per page, whatever its size, instead of two
+        # queries per search.
+        return SearchHistory.objects.prefetch_related(
+            'places',
+            Prefetch('places', queryset=RecommendedPlace.objects.filter(is_best=True), to_attr='best_places'),
+        )
+
+
+def _throttled_response(wait):
+    response = JsonResponse({"error": "Too many searches; try again later."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = retry_after(wait)
+    return response
+
+
+def _charge_search(request, key, limit):
+    """
+    SearchRateThrottle and the response cache for the plain Django views:
+    charges the search to the token's user or the client IP, at the
+    'cached' cost if the response cache has it. Returns (response cache
+    key, cached data or None, seconds to wait or 0).
+    """
+    user = token_user(request)
+    cache_key = response_cache_key(request, user, key)
+    cached = get_cache('responses').get(cache_key)
+    return cache_key, cached, throttle_wait(request, user, search_cost(cached=cached is not None, places=limit))
+
+
+@require_GET
+async def async_place_search(request):
+    """
+    Async variant of PlaceSearchView.get for ASGI deployments, running
+    SearchPipeline.arun. Identical in-flight searches are not coalesced:
+    search_flight makes waiters block a thread, so each search here runs on
+    its own, sharing only the upstream caches.
+    """
+    pipeline = get_pipeline()
+    try:
+        query, user_lat, user_lng, limit, radius = parse_search(request.GET, pipeline)
+    except InvalidSearch as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    cache_key, cached, wait = await sync_to_async(_charge_search)(
+        request, search_key(query, user_lat, user_lng, limit, radius), limit
+    )
+    if wait:
+        return _throttled_response(wait)
+    if cached is not None:
+        return JsonResponse(cached, status=status.HTTP_200_OK)
+
+    data, status_code = await pipeline.arun(query, user_lat, user_lng, limit, radius)
+    if status_code == status.HTTP_200_OK:
+        await sync_to_async(get_cache('responses').set)(cache_key, data)
+    return JsonResponse(data, status=status_code)
+
+
+def _stream_content_type(request):
+    if request.GET.get('stream') == 'sse' or 'text/event-stream' in request.headers.get('Accept', ''):
+        return SSE
+    return NDJSON
+
+
+def _streaming_response(stream, content_type):
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let a proxy hold back events
+    return response
+
+
+@require_GET
+def place_search_stream(request):
+    """
+    Streaming variant of the search: NDJSON by default, Server-Sent Events
+    with ?stream=sse or an Accept: text/event-stream header. Streams bypass
+    search_flight, as each client gets its own events as they happen.
+    """
+    pipeline = get_pipeline()
+    try:
+        query, user_lat, user_lng, limit, radius = parse_search(request.GET, pipeline)
+    except InvalidSearch as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Streams are always run afresh, so they are charged as full searches.
+    wait = throttle_wait(request, token_user(request), search_cost(places=limit))
+    if wait:
+        return _throttled_response(wait)
+
+    places, response = pipeline.find(canonical_query(query), user_lat, user_lng, limit, radius)
+    if places is None:
+        data, status_code = response
+        return JsonResponse(data, status=status_code)
+
+    content_type = _stream_content_type(request)
+    stream = stream_search(pipeline, query, user_lat, user_lng, places, content_type)
+    return _streaming_response(stream, content_type)
+
+
+@require_GET
+async def async_place_search_stream(request):
+    """place_search_stream for ASGI deployments."""
+    pipeline = get_pipeline()
+    try:
+        query, user_lat, user_lng, limit, radius = parse_search(request.GET, pipeline)
+    except InvalidSearch as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    user = await sync_to_async(token_user)(request)
+    wait = await sync_to_async(throttle_wait)(request, user, search_cost(places=limit))
+    if wait:
+        return _throttled_response(wait)
+
+    places, response = await pipeline.afind(canonical_query(query), user_lat, user_lng, limit, radius)
+    if places is None:
+        data, status_code = response
+        return JsonResponse(data, status=status_code)
+
+    content_type = _stream_content_type(request)
+    stream = astream_search(pipeline, query, user_lat, user_lng, places, content_type)
+    return _streaming_response(stream, content_type)
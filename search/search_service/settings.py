@@ -11,17 +11,266 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
+
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Modules shared by the search and user services live one level up.
+sys.path.append(str(BASE_DIR.parent))
+from common.database import database_from_env  # noqa: E402
+
 load_dotenv()
 
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Upstream endpoints, overridable so benchmarks can point them at local stubs.
+GOOGLE_PLACES_URL = os.getenv("GOOGLE_PLACES_URL", "https://maps.googleapis.com/maps/api/place/textsearch/json")
+GOOGLE_DISTANCE_MATRIX_URL = os.getenv(
+    "GOOGLE_DISTANCE_MATRIX_URL", "https://maps.googleapis.com/maps/api/distancematrix/json"
+)
+
+# Gemini enrichment: size of the process-wide pool that caps in-flight model
+# calls, and the per-search deadline (seconds) for all of them to finish.
+LLM_ENRICHMENT_MAX_WORKERS = int(os.getenv("LLM_ENRICHMENT_MAX_WORKERS", 16))
+LLM_ENRICHMENT_TIMEOUT = float(os.getenv("LLM_ENRICHMENT_TIMEOUT", 10))
+# 'concurrent' sends three prompts per place; 'batched' sends one JSON prompt
+# covering every place and falls back per place when its entry is invalid.
+LLM_ENRICHMENT_MODE = os.getenv("LLM_ENRICHMENT_MODE", "concurrent")
+# Dotted path to a callable taking a model name and returning a model to use
+# instead of Gemini, e.g. search_app.replay.replay_model for offline load
+# tests.
+LLM_MODEL_FACTORY = os.getenv("LLM_MODEL_FACTORY")
+# Gemini model per prompt kind ('description', 'review_summary', 'score',
+# 'batch'). A kind without a TASKS entry uses SMALL if it is listed in
+# SMALL_TASKS (comma-separated, e.g. "review_summary"), else DEFAULT. Each
+# worker builds one client per model name at startup and reuses it.
+LLM_MODELS = {
+    'DEFAULT': os.getenv("LLM_MODEL", "gemini-2.0-flash-001"),
+    'SMALL': os.getenv("LLM_SMALL_MODEL", "gemini-2.0-flash-lite-001"),
+    'SMALL_TASKS': [task for task in os.getenv("LLM_SMALL_MODEL_TASKS", "").split(",") if task],
+    'TASKS': {
+        task: os.getenv(f"LLM_MODEL_{task.upper()}")
+        for task in ('description', 'review_summary', 'score', 'batch')
+        if os.getenv(f"LLM_MODEL_{task.upper()}")
+    },
+}
+# Have each client make one count_tokens call at startup too, so the first
+# search doesn't pay for opening its connection. It costs one request per
+# model name and worker, and needs the API to be reachable when starting.
+LLM_WARM_CONNECTIONS = os.getenv("LLM_WARM_CONNECTIONS", "false").lower() == "true"
+# With LLM scoring off the best place is the local ranker's top pick and no
+# score prompts are sent.
+LLM_SCORING_ENABLED = os.getenv("LLM_SCORING_ENABLED", "true").lower() == "true"
+
+# "Respond fast, enrich later": when SEARCH_DEFER_ENRICHMENT is on (or a
+# request passes defer=true) a search returns places and distances right
+# away and finishes enrichment on an in-process pool of SEARCH_JOB_WORKERS
+# threads. Clients poll api/search/<id>/, optionally long-polling with
+# ?wait= up to SEARCH_LONG_POLL_MAX seconds.
+SEARCH_DEFER_ENRICHMENT = os.getenv("SEARCH_DEFER_ENRICHMENT", "false").lower() == "true"
+SEARCH_JOB_WORKERS = int(os.getenv("SEARCH_JOB_WORKERS", 4))
+SEARCH_LONG_POLL_MAX = float(os.getenv("SEARCH_LONG_POLL_MAX", 30))
+SEARCH_LONG_POLL_INTERVAL = 0.25
+
+# How distances are filled in: 'upstream' (Distance Matrix only), 'estimate'
+# (local haversine only), 'estimate_refine' (estimate now, fetch the real
+# values in the background for later searches) or 'fallback' (Distance
+# Matrix, estimating whatever it fails to return).
+DISTANCE_MODE = os.getenv("DISTANCE_MODE", "fallback")
+WALKING_SPEED_MPS = float(os.getenv("WALKING_SPEED_MPS", 1.4))
+# Walking routes are longer than the straight line between two points.
+WALKING_DETOUR_FACTOR = float(os.getenv("WALKING_DETOUR_FACTOR", 1.3))
+
+# Shared HTTP client for the Google adapters. Timeouts and backoff are in
+# seconds. Each request adds RETRY_BUDGET_RATIO retry tokens (up to
+# RETRY_BUDGET_MAX) and each retry spends one; an upstream API's circuit
+# (per host and path) opens after CIRCUIT_FAILURE_THRESHOLD consecutive
+# failures for CIRCUIT_RESET_TIMEOUT.
+UPSTREAM_HTTP = {
+    'POOL_SIZE': int(os.getenv("UPSTREAM_HTTP_POOL_SIZE", 20)),
+    'CONNECT_TIMEOUT': float(os.getenv("UPSTREAM_HTTP_CONNECT_TIMEOUT", 3.05)),
+    'READ_TIMEOUT': float(os.getenv("UPSTREAM_HTTP_READ_TIMEOUT", 10)),
+    'MAX_RETRIES': int(os.getenv("UPSTREAM_HTTP_MAX_RETRIES", 2)),
+    'BACKOFF': float(os.getenv("UPSTREAM_HTTP_BACKOFF", 0.1)),
+    'RETRY_BUDGET_RATIO': float(os.getenv("UPSTREAM_HTTP_RETRY_BUDGET_RATIO", 0.2)),
+    'RETRY_BUDGET_MAX': float(os.getenv("UPSTREAM_HTTP_RETRY_BUDGET_MAX", 10)),
+    'CIRCUIT_FAILURE_THRESHOLD': int(os.getenv("UPSTREAM_HTTP_CIRCUIT_FAILURE_THRESHOLD", 5)),
+    'CIRCUIT_RESET_TIMEOUT': float(os.getenv("UPSTREAM_HTTP_CIRCUIT_RESET_TIMEOUT", 30)),
+}
+
+# The 'default' cache holds everything processes share: the 'django'
+# SEARCH_CACHES backend, upstream budgets (BUDGET_PER_MINUTE), search
+# throttle counters and SINGLE_FLIGHT SHARED locks. The default LocMemCache
+# lives in each process, so with N workers those limits allow N times as
+# much. Set CACHE_BACKEND and CACHE_LOCATION to a shared cache, e.g.
+# django.core.cache.backends.redis.RedisCache with redis://host:6379/0, or
+# django.core.cache.backends.db.DatabaseCache with a table made by
+# createcachetable.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", ""),
+    },
+}
+
+# Coalescing of identical concurrent searches. Within a process this is
+# always on; SHARED also coordinates processes through a lock in the CACHES
+# alias ALIAS. Times are in seconds; a published result is kept for
+# RESULT_TTL so waiting processes can pick it up.
+SINGLE_FLIGHT = {
+    'SHARED': os.getenv("SINGLE_FLIGHT_SHARED", "false").lower() == "true",
+    'ALIAS': 'default',
+    'LOCK_TIMEOUT': float(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", 30)),
+    'RESULT_TTL': int(os.getenv("SINGLE_FLIGHT_RESULT_TTL", 5)),
+    'POLL_INTERVAL': float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.05)),
+}
+
+# Generated descriptions and review summaries are stored per place and reused
+# for PLACE_ENRICHMENT_TTL seconds. Bump PLACE_ENRICHMENT_VERSION when the
+# prompts change to regenerate them.
+PLACE_ENRICHMENT_TTL = int(os.getenv("PLACE_ENRICHMENT_TTL", 7 * 24 * 3600))
+PLACE_ENRICHMENT_VERSION = int(os.getenv("PLACE_ENRICHMENT_VERSION", 2))
+
+# Local place catalog built from Places API responses. In 'local_first'
+# MODE a search is answered from the catalog when it has at least
+# MIN_RESULTS matches no older than MAX_AGE_DAYS; 'google' always asks
+# Google. MAX_CANDIDATES bounds the rows examined per lookup.
+LOCAL_CATALOG = {
+    'MODE': os.getenv("LOCAL_CATALOG_MODE", "google"),
+    'MIN_RESULTS': int(os.getenv("LOCAL_CATALOG_MIN_RESULTS", 5)),
+    'MAX_AGE_DAYS': int(os.getenv("LOCAL_CATALOG_MAX_AGE_DAYS", 30)),
+    'MAX_CANDIDATES': int(os.getenv("LOCAL_CATALOG_MAX_CANDIDATES", 500)),
+}
+
+# Caches in front of the Google adapters. BACKEND is 'memory' (per-process
+# LRU with TTL), 'django' (the CACHES alias in ALIAS, shared across workers)
+# or 'none'. TTL is in seconds; GEOHASH_PRECISION sets the size of the
+# location cell that nearby searches share.
+SEARCH_CACHES = {
+    'places': {
+        'BACKEND': os.getenv("PLACES_CACHE_BACKEND", "memory"),
+        'ALIAS': 'default',
+        'TTL': int(os.getenv("PLACES_CACHE_TTL", 900)),
+        'MAX_ENTRIES': int(os.getenv("PLACES_CACHE_MAX_ENTRIES", 10000)),
+        'GEOHASH_PRECISION': int(os.getenv("PLACES_CACHE_GEOHASH_PRECISION", 6)),
+    },
+    # Distance Matrix elements keyed by (origin cell, destination, mode);
+    # precision 7 cells are roughly 150m across.
+    'distance': {
+        'BACKEND': os.getenv("DISTANCE_CACHE_BACKEND", "memory"),
+        'ALIAS': 'default',
+        'TTL': int(os.getenv("DISTANCE_CACHE_TTL", 3600)),
+        'MAX_ENTRIES': int(os.getenv("DISTANCE_CACHE_MAX_ENTRIES", 50000)),
+        'GEOHASH_PRECISION': int(os.getenv("DISTANCE_CACHE_GEOHASH_PRECISION", 7)),
+    },
+    # Whole search responses, per client (user, or IP when anonymous), so a
+    # client repeating a search within TTL seconds gets it back for the
+    # throttle's 'cached' cost.
+    'responses': {
+        'BACKEND': os.getenv("RESPONSE_CACHE_BACKEND", "memory"),
+        'ALIAS': 'default',
+        'TTL': int(os.getenv("RESPONSE_CACHE_TTL", 30)),
+        'MAX_ENTRIES': int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000)),
+    },
+}
+
+# Result fan-out: Places results are ranked locally and only the top `limit`
+# are enriched. Clients may pass limit and radius (metres), capped at
+# MAX_LIMIT and MAX_RADIUS.
+SEARCH_RESULTS = {
+    'DEFAULT_LIMIT': int(os.getenv("SEARCH_DEFAULT_LIMIT", 5)),
+    'MAX_LIMIT': int(os.getenv("SEARCH_MAX_LIMIT", 10)),
+    'DEFAULT_RADIUS': int(os.getenv("SEARCH_DEFAULT_RADIUS", 5000)),
+    'MAX_RADIUS': int(os.getenv("SEARCH_MAX_RADIUS", 50000)),
+}
+
+# Upstream rate limits, per upstream and API key. RATE/BURST is a token
+# bucket shaping each process's calls (waiting up to WAIT seconds for a
+# token); BUDGET_PER_MINUTE caps calls across all processes sharing the
+# CACHES alias ALIAS (only this process with the default LocMemCache). Distance Matrix is counted in elements. 0 disables a
+# limit. When Gemini is over its limit a search drops review summaries,
+# then descriptions, then LLM scoring rather than failing.
+UPSTREAM_RATE_LIMITS = {
+    'places': {
+        'RATE': float(os.getenv("PLACES_RATE_LIMIT", 10)),
+        'BURST': int(os.getenv("PLACES_RATE_BURST", 20)),
+        'WAIT': float(os.getenv("PLACES_RATE_WAIT", 0.5)),
+        'BUDGET_PER_MINUTE': int(os.getenv("PLACES_BUDGET_PER_MINUTE", 600)),
+        'ALIAS': 'default',
+    },
+    'distance_matrix': {
+        'RATE': float(os.getenv("DISTANCE_MATRIX_RATE_LIMIT", 500)),
+        'BURST': int(os.getenv("DISTANCE_MATRIX_RATE_BURST", 1000)),
+        'WAIT': float(os.getenv("DISTANCE_MATRIX_RATE_WAIT", 0.5)),
+        'BUDGET_PER_MINUTE': int(os.getenv("DISTANCE_MATRIX_BUDGET_PER_MINUTE", 30000)),
+        'ALIAS': 'default',
+    },
+    'gemini': {
+        'RATE': float(os.getenv("GEMINI_RATE_LIMIT", 30)),
+        'BURST': int(os.getenv("GEMINI_RATE_BURST", 60)),
+        'WAIT': float(os.getenv("GEMINI_RATE_WAIT", 0)),
+        'BUDGET_PER_MINUTE': int(os.getenv("GEMINI_BUDGET_PER_MINUTE", 2000)),
+        'ALIAS': 'default',
+    },
+}
+
+# Search throttling: each search is charged COSTS against a sliding window
+# per user (DEFAULT_THROTTLE_RATES 'search_user') or, for anonymous
+# requests, per IP ('search_ip'). A search answered from the response cache
+# costs 'cached'; any other costs 'search' plus 'per_place' for each place
+# it may enrich. Counters live in the CACHES alias ALIAS, so they are only
+# as shared between processes as that backend. Behind a proxy, set
+# TRUST_X_FORWARDED_FOR so clients are told apart by the forwarded address.
+SEARCH_THROTTLE = {
+    'ALIAS': 'default',
+    'TRUST_X_FORWARDED_FOR': os.getenv("SEARCH_THROTTLE_TRUST_X_FORWARDED_FOR", "false").lower() == "true",
+    'COSTS': {
+        'cached': int(os.getenv("SEARCH_THROTTLE_COST_CACHED", 1)),
+        'search': int(os.getenv("SEARCH_THROTTLE_COST_SEARCH", 3)),
+        'per_place': int(os.getenv("SEARCH_THROTTLE_COST_PER_PLACE", 2)),
+    },
+}
+
+# Upper bound on the items of one POST api/search/batch/ request.
+SEARCH_BATCH_MAX_ITEMS = int(os.getenv("SEARCH_BATCH_MAX_ITEMS", 25))
+
+# Local ranking: relative weights of the rating (pulled towards RATING_PRIOR
+# as if it had RATING_PRIOR_COUNT extra reviews), review count, closeness
+# within the radius and query terms matched by the name and types.
+SEARCH_RANKING = {
+    'WEIGHTS': {'rating': 0.35, 'popularity': 0.2, 'distance': 0.25, 'text': 0.2},
+    'RATING_PRIOR': 3.5,
+    'RATING_PRIOR_COUNT': 20,
+}
+
+# Metrics served at /metrics in the Prometheus text format. With
+# ALLOWED_IPS set (comma-separated), only those addresses may scrape them.
+SEARCH_METRICS = {
+    'ALLOWED_IPS': [ip for ip in os.getenv("METRICS_ALLOWED_IPS", "").split(",") if ip],
+}
+
+# Query canonicalization: searches are folded to one canonical form before
+# they reach Google, Gemini or any cache key. Stop phrases are dropped (the
+# location is sent separately) and SYNONYMS maps whole canonical queries to
+# another. Only list phrasings that search for the same thing: "ramen shop"
+# is "ramen", but "gift shop" is not "gift".
+SEARCH_QUERY_STOP_PHRASES = [
+    "near me", "nearby", "around me", "around here", "close to me", "close by", "in my area",
+]
+SEARCH_QUERY_SYNONYMS = {
+    "ramen shop": "ramen",
+    "ramen shops": "ramen",
+    "ramen place": "ramen",
+    "ramen restaurant": "ramen",
+    "sushi place": "sushi",
+    "sushi restaurant": "sushi",
+}
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -55,10 +304,16 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    # In search cost units per window; see SEARCH_THROTTLE.
+    'DEFAULT_THROTTLE_RATES': {
+        'search_user': os.getenv("SEARCH_THROTTLE_USER_RATE", "1200/min"),
+        'search_ip': os.getenv("SEARCH_THROTTLE_IP_RATE", "600/min"),
+    },
 }
 
 MIDDLEWARE = [
+    'search_app.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,15 +343,16 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'search_service.wsgi.application'
 
+# Serves the async search endpoint (api/search/async/) without blocking on I/O.
+ASGI_APPLICATION = 'search_service.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Configured from DB_ENGINE and related variables; see common/database.py.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_from_env(BASE_DIR, 'search'),
 }
 
 
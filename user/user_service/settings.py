@@ -3,11 +3,17 @@ Django settings for user_service project.
 """
 
 import os
+import sys
 from pathlib import Path
 
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Modules shared by the search and user services live one level up.
+sys.path.append(str(BASE_DIR.parent))
+from common.database import database_from_env  # noqa: E402
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'your_secret_key_here'
 
@@ -63,11 +69,9 @@ WSGI_APPLICATION = 'user_service.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Configured from DB_ENGINE and related variables; see common/database.py.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_from_env(BASE_DIR, 'user'),
 }
 
 